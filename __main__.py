@@ -1,18 +1,69 @@
+import argparse
+import os
 import sys
 
-from PyQt5.QtWidgets import QApplication
+# Allows running as a package (python -m Tagger) as well as from inside the folder.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from gui import GUI
-from utils import get_logger, FileHandler
+from library import DEFAULT_TAG_WORKERS
+from renaming import DEFAULT_WRITE_WORKERS, TAG_PADDING
+from utils import get_logger, set_log_level, FileHandler, DEFAULT_LOG_LEVEL
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog='Tagger', description='A very simple music renamer and tagger.')
+    parser.add_argument('--batch', metavar='FOLDER',
+                        help='Rename the music files of a folder without the GUI.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Finish the last rename if it was stopped before it finished, without the GUI.')
+    parser.add_argument('--revert-last', action='store_true',
+                        help='Give the files of the last rename their old names back, without the GUI.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='With --batch, only show what would be renamed and tagged.')
+    parser.add_argument('--tag', action='store_true',
+                        help='With --batch, tag files with the title and artist from their new names.')
+    parser.add_argument('--json', action='store_true',
+                        help='With --batch, --resume or --revert-last, write the results to stdout as JSON.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='With --batch, the number of threads used to read tags.')
+    parser.add_argument('--write-workers', type=int, default=None,
+                        help='With --batch, the number of threads used to save tags.')
+    parser.add_argument('--log-level', default=None, choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), type=str.upper,
+                        help='The lowest level of messages written to the log, DEBUG by default.')
+    # Qt options are left for QApplication. Without the GUI there is no Qt, so an unknown option is a mistake,
+    # like a mistyped --dry-run, and must not start a real rename.
+    args, qt_args = parser.parse_known_args()
+    if qt_args and (args.batch or args.resume or args.revert_last):
+        parser.error(f'unrecognized arguments: {" ".join(qt_args)}')
+    return args, qt_args
 
 
 def main():
     log = get_logger('Tagger')
-
-    app = QApplication(sys.argv)
+    args, qt_args = parse_arguments()
 
     file_handler = FileHandler()
     start_settings = file_handler.load_settings()
+    set_log_level(args.log_level or start_settings.get('log_level', DEFAULT_LOG_LEVEL))
+
+    if args.resume or args.revert_last:
+        from batch import run_replay
+        sys.exit(run_replay(revert=args.revert_last, json_output=args.json))
+
+    if args.batch:
+        from batch import run_batch
+        from filters import WordFilter
+        from rules import load_rules
+        workers = args.workers or start_settings.get('tag_workers', DEFAULT_TAG_WORKERS)
+        write_workers = args.write_workers or start_settings.get('write_workers', DEFAULT_WRITE_WORKERS)
+        sys.exit(run_batch(args.batch, dry_run=args.dry_run, tag=args.tag, json_output=args.json, workers=workers,
+                           write_workers=write_workers, padding=start_settings.get('tag_padding', TAG_PADDING),
+                           rules=load_rules(start_settings), word_filter=WordFilter(start_settings.get('word_filter'))))
+
+    from PyQt5.QtWidgets import QApplication
+    from gui import GUI
+
+    app = QApplication(sys.argv[:1] + qt_args)
     qProcess = GUI(start_settings)
 
     EXIT_CODE = app.exec_()
@@ -0,0 +1,206 @@
+"""
+Headless batch mode, runs the scan -> filter -> tag -> rename pipeline of the GUI without Qt.
+Progress is written to stdout, or to stderr when the results are written to stdout as JSON.
+"""
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from filters import WordFilter, split_tag
+from journal import RenameJournal
+from library import scan_folder, split_extension, read_tags_cached, suggest_names, NameReservations, \
+    DEFAULT_TAG_WORKERS
+from renaming import save_tags_concurrently, apply_renames, PlanEntry, RenamePlan, TagWriteStats, file_version, \
+    DEFAULT_WRITE_WORKERS, TAG_PADDING
+from tag_cache import TagCache
+from utils import get_logger
+
+log = get_logger('Tagger.batch')
+
+
+def _progress(json_output):
+    out = sys.stderr if json_output else sys.stdout
+
+    def progress(text):
+        print(text, file=out, flush=True)
+
+    return progress
+
+
+def _rename(renames, journal, cache, progress):
+    """ Renames files, recorded in a begun journal batch, and returns the results. """
+    rename_results = []
+    for done, (old_path, new_path, renamed) in enumerate(apply_renames(renames, journal), 1):
+        if renamed:
+            cache.rename(old_path, new_path)
+        progress(f'[{done}/{len(renames)}] {"Renamed" if renamed else "Failed to rename"} '
+                 f'"{old_path}" to "{new_path}"')
+        rename_results.append({'from': old_path, 'to': new_path, 'renamed': renamed})
+    return rename_results
+
+
+def run_replay(revert=False, json_output=False):
+    """
+    Finishes the rename that was stopped before it finished, or reverts the last rename, from the rename journal.
+
+    :param revert: Revert the last rename instead.
+    :param json_output: Write the results to stdout as JSON.
+    :return: The exit code, 1 if there was nothing to do or any file failed to be renamed.
+    """
+    progress = _progress(json_output)
+    journal = RenameJournal()
+
+    unfinished = journal.unfinished()
+    if revert:
+        if unfinished is not None:
+            progress('The last rename was stopped before it finished. Run with --resume to finish it first.')
+            return 1
+        batch = journal.last_batch()
+        if batch is None:
+            progress('There is no rename to revert.')
+            return 1
+        renames = journal.begin_revert(batch)
+    else:
+        batch = unfinished
+        if batch is None:
+            progress('There is no unfinished rename to resume.')
+            return 1
+        renames = journal.resume(batch)
+
+    progress(f'{"Reverting" if revert else "Resuming"} {len(renames)} renames in "{batch.folder}".')
+    cache = TagCache()
+    rename_results = _rename(renames, journal, cache, progress)
+    journal.finish()
+    cache.close()
+
+    errors = sum(result['renamed'] is False for result in rename_results)
+    progress(f'{"Revert" if revert else "Resume"} complete: {len(renames) - errors} of {len(renames)} renames done. '
+             f'Encountered a total of {errors} errors.')
+    log.info(f'Journal batch {batch.id} {"reverted" if revert else "resumed"}, {errors} errors.')
+
+    if json_output:
+        json.dump({'folder': batch.folder,
+                   'batch': batch.id,
+                   'revert': revert,
+                   'renames': rename_results,
+                   'errors': errors},
+                  sys.stdout, indent=4)
+        sys.stdout.write('\n')
+
+    return 1 if errors else 0
+
+
+def run_batch(folder_path, dry_run=False, tag=False, json_output=False, workers=DEFAULT_TAG_WORKERS,
+              write_workers=DEFAULT_WRITE_WORKERS, padding=TAG_PADDING, rules=None, word_filter=None):
+    """
+    Renames, and optionally tags, the music files of a folder like the 'Rename songs' button does.
+
+    :param dry_run: Only report what would be done, without writing to any file.
+    :param tag: Generate the title and artist from the new names, like the 'Tag all songs' button.
+    :param json_output: Write the results to stdout as JSON.
+    :param workers: The number of threads used to read tags.
+    :param write_workers: The number of threads used to save tags.
+    :param padding: The bytes of padding reserved when a tag doesn't fit, see renaming.save_tags.
+    :param rules: Optional rules from rules.compile_rules, applied to the new names.
+    :param word_filter: The WordFilter used for the new names, the default filter if not given.
+    :return: The exit code, 1 if any file failed to be tagged or renamed.
+    """
+    progress = _progress(json_output)
+
+    log.info(f'Starting batch run in "{folder_path}", dry run: {dry_run}.')
+
+    journal = RenameJournal()
+    if not dry_run and journal.unfinished() is not None:
+        progress('The last rename was stopped before it finished. Run with --resume to finish it first.')
+        return 1
+
+    try:
+        entries, folder = scan_folder(folder_path)
+    except OSError as e:
+        progress(f'Failed to list folder "{folder_path}": {e}')
+        return 1
+
+    progress(f'Found {len(entries)} music files in "{folder_path}".')
+
+    cache = TagCache()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        tags = read_tags_cached(entries, pool, cache)
+    cache.commit()
+
+    files = [entry.name for entry in entries]
+    plan_entries = []
+    new_names = suggest_names(files, NameReservations(folder), word_filter or WordFilter(), rules)
+    for row_id, (entry, (new_name, flagged), (title, artist)) in enumerate(zip(entries, new_names, tags)):
+        name, ext = split_extension(entry.name)
+        loaded = (title, artist, file_version(entry.stat()))
+
+        if tag:
+            split = split_tag(new_name)
+            if split is not None:
+                artist, title = split
+
+        plan_entries.append(PlanEntry(row_id, name, new_name, ext, title, artist, loaded))
+
+    plan = RenamePlan(folder_path, tuple(plan_entries))
+
+    # Tags are written before renaming, to the files by their old names.
+    stats = TagWriteStats()
+    saves, failed = plan.load_tags()
+    tag_results = [{'file': path, 'title': entry.title, 'artist': entry.artist, 'saved': False}
+                   for path, entry in failed]
+
+    if dry_run:
+        for done, (meta, path, entry) in enumerate(saves, 1):
+            progress(f'[{done}/{len(saves)}] Would tag "{path}": {entry.artist} - {entry.title}')
+            tag_results.append({'file': path, 'title': entry.title, 'artist': entry.artist, 'saved': None})
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, write_workers)) as pool:
+            for done, (path, entry, saved) in enumerate(save_tags_concurrently(saves, pool, stats, padding), 1):
+                if saved:
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        # The tag was saved, the file is just read again on the next load.
+                        pass
+                    else:
+                        cache.put(path, stat, entry.title, entry.artist)
+                progress(f'[{done}/{len(saves)}] {"Tagged" if saved else "Failed to tag"} "{path}"')
+                tag_results.append({'file': path, 'title': entry.title, 'artist': entry.artist, 'saved': saved})
+
+    renames = plan.renames()
+    if dry_run:
+        rename_results = []
+        for done, (old_path, new_path) in enumerate(renames, 1):
+            progress(f'[{done}/{len(renames)}] Would rename "{old_path}" to "{new_path}"')
+            rename_results.append({'from': old_path, 'to': new_path, 'renamed': None})
+    else:
+        journal.begin(renames, folder_path)
+        rename_results = _rename(renames, journal, cache, progress)
+        journal.finish()
+
+    cache.close()
+
+    errors = sum(result['saved'] is False for result in tag_results) + \
+        sum(result['renamed'] is False for result in rename_results)
+
+    progress(f'{"Dry run" if dry_run else "Batch run"} complete: {len(saves)} tags and {len(renames)} renames '
+             f'for {len(plan.entries)} files. Encountered a total of {errors} errors.')
+    if stats.in_place or stats.rewrites:
+        progress(f'{stats}.')
+    log.info(f'Batch run complete, {len(saves)} tags, {len(renames)} renames and {errors} errors. Tag writes: {stats}')
+
+    if json_output:
+        json.dump({'folder': folder_path,
+                   'dry_run': dry_run,
+                   'files': len(plan.entries),
+                   'tags': tag_results,
+                   'renames': rename_results,
+                   'tag_writes': {'in_place': stats.in_place,
+                                  'rewrites': stats.rewrites,
+                                  'bytes_written': stats.bytes_written},
+                   'errors': errors},
+                  sys.stdout, indent=4)
+        sys.stdout.write('\n')
+
+    return 1 if errors else 0
@@ -0,0 +1,208 @@
+"""
+Benchmarks for the load and rename pipeline, on a generated music library.
+
+Creates N tiny MP3/FLAC/OGG files with YouTube style names in a temporary folder, about half of them with
+an ID3 tag, and times each stage. The table and renamer stages run with QT_QPA_PLATFORM=offscreen, and are
+skipped if PyQt5 is not installed. Results are written as JSON.
+
+    python benchmark.py --sizes 1000 10000 100000 --output benchmark_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mutagen.easyid3 import EasyID3
+
+from filters import WordFilter, capitalize
+from journal import RenameJournal
+from library import scan_folder, split_extension, read_tags_cached, create_rows, NameReservations, \
+    DEFAULT_TAG_WORKERS
+from tag_cache import TagCache
+
+ARTISTS = ['Nightcore', 'Aurora', 'The Midnight', 'Daft Punk', 'Sia', 'Avicii', 'Kygo', 'Alan Walker',
+           'Lindsey Stirling', 'Two Steps From Hell', 'Porter Robinson', 'Madeon', 'Zedd', 'Marshmello']
+WORDS = ['love', 'night', 'fire', 'dream', 'heart', 'rain', 'stars', 'city', 'lights', 'ocean', 'runaway',
+         'forever', 'alone', 'faded', 'shelter', 'wake', 'me', 'up', 'the', 'of', 'in', 'my']
+DECORATIONS = ['', '', ' (Lyrics)', ' (Official Music Video)', ' [HD]', ' (lyric video) HD', ' (Audio)',
+               ' [Official Video]', ' 「Nightcore」', ' (Switching Vocals)', ' with lyrics', ' [Animated]',
+               ' (feat. Someone)', ' (2018)', ' | Diversity Release']
+SEPARATORS = [' - ', ' - ', ' - ', ' → ', '_-_', ' ', ' -- ']
+
+# Just enough of each format for the files to look real.
+CONTENT = {'mp3': b'\xff\xfb\x90\x64' + bytes(413),
+           'flac': b'fLaC\x80\x00\x00\x22' + bytes(34),
+           'ogg': b'OggS\x00\x02' + bytes(58)}
+FORMATS = ['mp3', 'mp3', 'mp3', 'flac', 'ogg']
+
+
+def random_name(rng):
+    artist = rng.choice(ARTISTS)
+    title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+    if rng.random() < 0.5:
+        title = title.title()
+    name = ''.join((artist, rng.choice(SEPARATORS), title, rng.choice(DECORATIONS)))
+    return name, artist, title
+
+
+def generate_library(folder, files, seed=0):
+    """ Creates a folder with a number of tiny music files, about half with an ID3 tag. """
+    rng = random.Random(seed)
+    used = set()
+
+    for number in range(files):
+        name, artist, title = random_name(rng)
+        ext = rng.choice(FORMATS)
+        filename = f'{name}.{ext}'
+        if filename in used:
+            filename = f'{name} {number}.{ext}'
+        used.add(filename)
+
+        path = os.path.join(folder, filename)
+        with open(path, 'wb') as f:
+            f.write(CONTENT[ext])
+
+        if rng.random() < 0.5:
+            meta = EasyID3()
+            meta['title'] = title
+            meta['artist'] = artist
+            meta.save(path)
+
+
+class Benchmark:
+    def __init__(self, files):
+        self.files = files
+        self.results = []
+
+    def time(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+
+        self.results.append({'files': self.files,
+                             'stage': stage,
+                             'seconds': round(seconds, 6),
+                             'files_per_second': round(self.files / seconds, 1) if seconds else None})
+        print(f'{self.files:>8} files | {stage:<32} | {seconds:>9.3f} s', flush=True)
+        return result
+
+
+def run_pipeline(folder, files, workers, gui=True):
+    bench = Benchmark(files)
+    cache_path = os.path.join(folder, os.pardir, 'tag_cache.db')
+
+    entries, names = bench.time('scan_folder', scan_folder, folder)
+
+    def read_all(cache):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            tags = read_tags_cached(entries, pool, cache)
+        cache.close()
+        return tags
+
+    tags = bench.time('read_tags (cold cache)', read_all, TagCache(cache_path))
+    bench.time('read_tags (warm cache)', read_all, TagCache(cache_path))
+
+    word_filter = WordFilter()
+    plain_names = [split_extension(entry.name)[0] for entry in entries]
+    bench.time('WordFilter.__call__', lambda: [word_filter(name) for name in plain_names])
+    filtered = [word_filter(name) for name in plain_names]
+    bench.time('capitalize', lambda: [capitalize(name) for name in filtered])
+    bench.time('WordFilter.normalize_all', word_filter.normalize_all, plain_names)
+
+    rows = bench.time('suggest_names', create_rows, entries, tags, NameReservations(names), word_filter)
+
+    if gui:
+        run_gui_stages(bench, folder, rows, cache_path)
+
+    return bench.results
+
+
+def run_gui_stages(bench, folder, rows, cache_path):
+    from PyQt5.QtWidgets import QApplication
+    from rename_thread import Renamer
+    from table_widget import TableWidget
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    # Collisions would open a modal dialog.
+    TableWidget.alert_message = lambda *args, **kwargs: None
+
+    table = TableWidget(folder)
+    model = table.model()
+    bench.time('TableModel.append_rows', model.append_rows, rows)
+    row_ids = model.row_ids()
+
+    # Keep original goes first, so the names are still changed when the renamer runs.
+    for action in ('Keep original', 'Remove parentheses', 'Remove brackets', 'Remove numbers', 'Remove punctuation',
+                   'Swap positions', 'Reverse tag'):
+        bench.time(f'action: {action}', table._cell_action, action, list(row_ids))
+    bench.time('action: chained', table.apply_name_actions,
+               ['Remove parentheses', 'Remove brackets', 'Remove numbers', 'Remove punctuation'], list(row_ids))
+    bench.time('undo', table.undo_action)
+    bench.time('Add tag(s)', table.create_tag, list(row_ids))
+
+    plan = bench.time('TableModel.rename_plan', model.rename_plan, folder)
+    if not plan.renames():
+        print(f'{bench.files:>8} files | Renamer.run skipped, nothing to rename.', flush=True)
+        return
+    renamer = Renamer(plan)
+    # Keeps the journal and cache of the benchmark out of the working directory.
+    renamer.journal = RenameJournal(os.path.join(folder, os.pardir, 'rename_journal.jsonl'))
+    renamer.cache = TagCache(cache_path)
+    bench.time('Renamer.run', renamer.run)
+    app.processEvents()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the Tagger load and rename pipeline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Number of files to generate for each run.')
+    parser.add_argument('--output', default='benchmark_results.json', help='File to write the results to.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_TAG_WORKERS, help='Threads used to read tags.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated names.')
+    parser.add_argument('--no-gui', action='store_true', help='Skip the stages that need PyQt5.')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated folders.')
+    args = parser.parse_args()
+
+    gui = not args.no_gui
+    if gui:
+        try:
+            import PyQt5
+        except ImportError:
+            print('PyQt5 is not installed, skipping the table and renamer stages.')
+            gui = False
+
+    results = []
+    for files in args.sizes:
+        root = tempfile.mkdtemp(prefix=f'tagger_bench_{files}_')
+        folder = os.path.join(root, 'music')
+        os.mkdir(folder)
+        try:
+            start = time.perf_counter()
+            generate_library(folder, files, args.seed)
+            print(f'Generated {files} files in {time.perf_counter() - start:.1f} s ({folder})', flush=True)
+
+            results.extend(run_pipeline(folder, files, args.workers, gui))
+        finally:
+            if not args.keep:
+                shutil.rmtree(root, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'workers': args.workers,
+                   'results': results},
+                  f, indent=4)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
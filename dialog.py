@@ -46,3 +46,86 @@ class Dialog(QDialog):
             return self.option.value()
         else:
             return 300  # Default value
+
+
+class FilterDialog(QDialog):
+    """ Edits the words the word filter replaces, and what they are replaced with. """
+
+    def __init__(self, replace_dict: dict, default_dict: dict, parent=None):
+        super(FilterDialog, self).__init__(parent)
+        self.setWindowTitle('Word filter')
+        self.default_dict = default_dict
+
+        self.label = QLabel(color_text('Words to replace:', 'limegreen'))
+        self.tooltip = QLabel('Words are found in any case. Leave the replacement empty to remove the word.')
+
+        self.table = QTableWidget(0, 2, self)
+        self.table.setHorizontalHeaderLabels(('Word', 'Replace with'))
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().hide()
+        self.set_filter(replace_dict)
+
+        self.add_button = QPushButton('Add', self)
+        self.add_button.clicked.connect(lambda: self.add_row())
+        self.remove_button = QPushButton('Remove', self)
+        self.remove_button.clicked.connect(self.remove_rows)
+        self.reset_button = QPushButton('Reset', self)
+        self.reset_button.clicked.connect(lambda: self.set_filter(self.default_dict))
+
+        self.ok_button = QPushButton('Ok', self)
+        self.ok_button.setFixedSize(self.ok_button.sizeHint())
+        self.ok_button.clicked.connect(self.accept)
+
+        self.cancel_button = QPushButton('Cancel', self)
+        self.cancel_button.setFixedSize(self.cancel_button.sizeHint())
+        self.cancel_button.clicked.connect(self.reject)
+
+        layout = QGridLayout(self)
+        layout.addWidget(self.label, 0, 0, 1, 3)
+        layout.addWidget(self.tooltip, 1, 0, 1, 3)
+        layout.addWidget(self.table, 2, 0, 1, 3)
+        layout.addWidget(self.add_button, 3, 0)
+        layout.addWidget(self.remove_button, 3, 1)
+        layout.addWidget(self.reset_button, 3, 2)
+
+        layout.setColumnStretch(0, 1)
+        layout.setColumnStretch(1, 0)
+        layout.setColumnStretch(2, 0)
+        layout.addWidget(self.ok_button, 4, 1)
+        layout.addWidget(self.cancel_button, 4, 2)
+
+        self.resize(420, 480)
+
+    def set_filter(self, replace_dict):
+        self.table.setRowCount(0)
+        for word, replacement in replace_dict.items():
+            self.add_row(word, replacement)
+
+    def add_row(self, word='', replacement=''):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        # Spaces matter in the filter, like in ' hd', so they are shown quoted. The quotes are optional when editing.
+        self.table.setItem(row, 0, QTableWidgetItem(f"'{word}'" if word else ''))
+        self.table.setItem(row, 1, QTableWidgetItem(f"'{replacement}'" if word else ''))
+        if not word:
+            self.table.editItem(self.table.item(row, 0))
+
+    def remove_rows(self):
+        for row in sorted({index.row() for index in self.table.selectedIndexes()}, reverse=True):
+            self.table.removeRow(row)
+
+    @staticmethod
+    def _text(item):
+        text = item.text() if item is not None else ''
+        if len(text) >= 2 and text[0] == text[-1] and text[0] in '\'"':
+            return text[1:-1]
+        return text
+
+    def get_filter(self):
+        """ The edited filter as word -> replacement, rows without a word are left out. """
+        replace_dict = {}
+        for row in range(self.table.rowCount()):
+            word = self._text(self.table.item(row, 0))
+            if word:
+                replace_dict[word.lower()] = self._text(self.table.item(row, 1))
+        return replace_dict
@@ -0,0 +1,171 @@
+import re
+from functools import lru_cache
+
+# Cleans up the text left after replacing words, in one pass. The alternatives are tried in order at every position:
+# separators and spaces at the end, spaces at the start, and runs of spaces, which become a single space.
+CLEANUP = r'( +[-.,/\\]* +$)|(^ +)|( {2,})'
+# Also capitalizes the first letter of the text and every letter after ' .-()[]', like capitalize().
+CLEANUP_CAPITALIZE = CLEANUP + r'|(?<![^ .\-()\[\]])([^ ])'
+# Same, for many names joined by newlines.
+CLEANUP_CAPITALIZE_LINES = CLEANUP + r'|(?<![^ .\-()\[\]\n])([^ \n])'
+
+
+def _cleanup(match):
+    group = match.lastindex
+    if group == 4:
+        return match.group(4).upper()
+    elif group == 3:
+        return ' '
+    return ''
+
+
+def filter_pattern(substrings):
+    """
+    Creates a regex pattern matching any of the substrings, longest first.
+    The lookahead for their first characters lets the regex skip most positions without trying every substring.
+    """
+    if not substrings:
+        return '(?!)'
+    substrings = sorted(substrings, key=len, reverse=True)
+    first = ''.join(sorted({re.escape(substring[0]) for substring in substrings}))
+    return f'(?=[{first}])(?:{"|".join(map(re.escape, substrings))})'
+
+
+@lru_cache(maxsize=8)
+def _compiled_filter(words):
+    return re.compile(filter_pattern(words), re.IGNORECASE)
+
+
+def compile_filter(replace_dict):
+    """
+    The regex matching any word of a filter dictionary. Compiled regexes are cached by the words,
+    so filters with the same words share one, and switching back to an earlier filter doesn't compile it again.
+    """
+    return _compiled_filter(tuple(sorted(replace_dict)))
+
+
+def clean_spaces(text):
+    """ Removes spaces at the start and end, and replaces runs of spaces with a single space. """
+    return ' '.join(filter(None, text.split(' ')))
+
+
+def capitalize(input_str):
+    output = []
+    for idx, letter in enumerate(input_str):
+        try:
+            letter: str
+            if letter.isupper():
+                pass
+            elif idx == 0:
+                letter = letter.upper()
+            elif input_str[idx - 1] in (' ', '.', '-', '(', ')', '[', ']'):
+                letter = letter.upper()
+        except Exception as e:
+            print(e)
+        output.append(letter)
+
+    return ''.join(output)
+
+
+PARENTHESES = re.compile(r' *\([^)]*\) *')
+PARENTHESIS = re.compile(r'[()]')
+BRACKETS = re.compile(r' *\[[^)]*\] *')
+BRACKET = re.compile(r'[\[\]]')
+NUMBERS = re.compile(r'[0-9]+')
+PUNCTUATION = re.compile(r'[.,\'"]+')
+
+
+def remove_parentheses(text):
+    return PARENTHESIS.sub('', PARENTHESES.sub('', text))
+
+
+def remove_brackets(text):
+    return BRACKET.sub('', BRACKETS.sub('', text))
+
+
+def remove_numbers(text):
+    return NUMBERS.sub('', text)
+
+
+def remove_punctuation(text):
+    return PUNCTUATION.sub('', text)
+
+
+def swap_positions(text):
+    """ Swaps the parts of a name formatted as 'Artist - Title'. Other names are left as they are. """
+    parts = text.split(' - ')
+    return ' - '.join(reversed(parts)) if len(parts) == 2 else text
+
+
+def split_tag(name):
+    """ Splits a name formatted as 'Artist - Title' into (artist, title), or returns None. """
+    if name.count(' - ') != 1:
+        return None
+    artist, title = name.split(' - ')
+    return artist, title
+
+
+class WordFilter:
+    # The clean up regexes are the same for every filter, so they are compiled once.
+    cleanup = re.compile(CLEANUP)
+    cleanup_capitalize = re.compile(CLEANUP_CAPITALIZE)
+    cleanup_capitalize_lines = re.compile(CLEANUP_CAPITALIZE_LINES, re.MULTILINE)
+
+    def __init__(self, replace_dict: dict = None):
+        self.update_filter(self.get_base_dict() if replace_dict is None else replace_dict)
+
+    def get_base_dict(self):
+        replace_dict = {
+            '(lyrics)': '',
+            '(lyric)': '',
+            'lyric': '',
+            'music': '',
+            'video': '',
+            ' hd': '',
+            'lyrics': '',
+            'audio': '',
+            'with lyrics': '',
+            ' hq': '',
+            'switching vocals': '',
+            '→': ' -',
+            '  ': ' ',
+            '_': '',
+            '」': '',
+            '「': '',
+            '[animated]': '',
+            '[ ~secret-nightcore~ edit ]': '',
+            'diversity release': '',
+            'simplicity release': ''
+        }
+        return replace_dict
+
+    def _replace(self, match):
+        return self.replace_dict[match.group(0).lower()]
+
+    def __call__(self, text):
+        return self.cleanup.sub(_cleanup, self.regexp.sub(self._replace, text))
+
+    def normalize(self, text):
+        """ Filters and capitalizes a name, the same as capitalize(word_filter(text)) but in two regex passes. """
+        return self.cleanup_capitalize.sub(_cleanup, self.regexp.sub(self._replace, text))
+
+    def normalize_all(self, names):
+        """
+        Normalizes a list of names, like normalize.
+        The names are joined into one text, so each regex runs once for the whole list.
+        """
+        if not names:
+            return []
+        if any('\n' in name for name in names):
+            return [self.normalize(name) for name in names]
+
+        text = self.regexp.sub(self._replace, '\n'.join(names))
+        return self.cleanup_capitalize_lines.sub(_cleanup, text).split('\n')
+
+    def update_filter(self, replace_dict):
+        """ Sets the words to replace. Words are matched case insensitive, so they are stored in lower case. """
+        self.replace_dict = {word.lower(): replacement for word, replacement in replace_dict.items() if word}
+        self.regexp = compile_filter(self.replace_dict)
+
+    def get_replace_dict(self):
+        return self.replace_dict
@@ -1,85 +1,22 @@
 import os.path
-import re
 import sys
 import time
 
-import mutagen
-import mutagen.mp3
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
-from mutagen.easyid3 import EasyID3
 
-from dialog import Dialog
-from rename_thread import Renamer
-from table_widget import TableWidget, TableWidgetItem
-from utils import stylesheet, get_logger, LOG_FILE
-
-
-def capitalize(input_str):
-    output = []
-    for idx, letter in enumerate(input_str):
-        try:
-            letter: str
-            if letter.isupper():
-                pass
-            elif idx == 0:
-                letter = letter.upper()
-            elif input_str[idx - 1] in (' ', '.', '-', '(', ')', '[', ']'):
-                letter = letter.upper()
-        except Exception as e:
-            print(e)
-        output.append(letter)
-
-    return ''.join(output)
-
-
-class WordFilter:
-    def __init__(self, replace_dict: dict = None):
-        if replace_dict is None:
-            self.replace_dict = self.get_base_dict()
-        else:
-            self.replace_dict = replace_dict
-
-        substrings = sorted(self.replace_dict, key=len, reverse=True)
-        self.regexp = re.compile('|'.join(map(re.escape, substrings)), re.IGNORECASE)
-
-    def get_base_dict(self):
-        replace_dict = {
-            '(lyrics)': '',
-            '(lyric)': '',
-            'lyric': '',
-            'music': '',
-            'video': '',
-            ' hd': '',
-            'lyrics': '',
-            'audio': '',
-            'with lyrics': '',
-            ' hq': '',
-            'switching vocals': '',
-            '→': ' -',
-            '  ': ' ',
-            '_': '',
-            '」': '',
-            '「': '',
-            '[animated]': '',
-            '[ ~secret-nightcore~ edit ]': '',
-            'diversity release': '',
-            'simplicity release': ''
-        }
-        return replace_dict
-
-    def __call__(self, text):
-        text = self.regexp.sub(lambda match: self.replace_dict[match.group(0).lower()], text)
-        return re.sub(r' +', ' ', re.sub(r'(^ +)', '', re.sub(r'( +[-.,/\\]* +$)', '', text)))
-
-    def update_filter(self, replace_dict):
-        self.replace_dict = replace_dict
-        substrings = sorted(self.replace_dict, key=len, reverse=True)
-        self.regexp = re.compile('|'.join(map(re.escape, substrings)))
-
-    def get_replace_dict(self):
-        return self.replace_dict
+from dialog import Dialog, FilterDialog
+from filters import WordFilter
+from library import DEFAULT_TAG_WORKERS
+from renaming import DEFAULT_WRITE_WORKERS, TAG_PADDING
+from rename_thread import Renamer, Previewer
+from rules import load_rules
+from scan_thread import Scanner
+from table_widget import TableWidget
+from undo import DEFAULT_UNDO_ENTRIES, DEFAULT_UNDO_CELLS
+from utils import stylesheet, get_logger, LOG_FILE, FileHandler
+from watcher import FolderWatcher, FolderSync
 
 
 # TODO: Fix right click on wrong columns
@@ -135,33 +72,20 @@ class GUI(QMainWindow):
         # TODO: Exception handling for tagging!
         # TODO: Add icons!
 
-        self.word_filter = WordFilter()
+        self.word_filter = WordFilter(self.settings.get('word_filter'))
+        self.rules = load_rules(self.settings)
         self.setWindowTitle('Tagger')
-        self.table = TableWidget(folder, parent=self)
+        self.table = TableWidget(folder, parent=self,
+                                 undo_entries=self.settings.get('undo_entries', DEFAULT_UNDO_ENTRIES),
+                                 undo_cells=self.settings.get('undo_cells', DEFAULT_UNDO_CELLS))
+        self.table.rules = self.rules
 
         self.setStyleSheet(stylesheet)
         self.log.debug('Stylesheet set.')
         # self.items.setRowCount(4)
 
-        self.table.setColumnCount(5)
-
-        self.table.setHorizontalHeaderLabels(['Old name', 'New name', 'Filetype', 'Title', 'Artist'])
         self.table.horizontalHeader().setVisible(True)
         # self.items.verticalHeader().setVisible(False)
-        self.log.debug('Fetching files and populating table...')
-        self.get_names()
-        self.log.debug('Table populated!')
-        self.table.resizeColumnsToContents()
-        self.table.resizeRowsToContents()
-
-        # self.table.resizeColumnsToContents()
-        # self.table.resizeRowsToContents()
-
-        horizontal_header = self.table.horizontalHeader()
-        horizontal_header.setSectionResizeMode(0, QHeaderView.Stretch)
-        horizontal_header.setSectionResizeMode(1, QHeaderView.Stretch)
-
-        self.log.debug('Table resized to contents')
 
         # shortcut = QShortcut("Ctrl+N", self.items)
         # shortcut.em
@@ -181,17 +105,42 @@ class GUI(QMainWindow):
         self.tagall_btn.setFixedWidth(self.tagall_btn.fontMetrics().width(self.tagall_btn.text()) + 10)
         self.tagall_btn.clicked.connect(self.tag_all_songs)
 
+        self.cancel_btn = QPushButton('Cancel loading')
+        self.cancel_btn.setFixedWidth(self.cancel_btn.fontMetrics().width('Cancel renaming') + 10)
+        self.cancel_btn.clicked.connect(self.cancel_work)
+        self.cancel_btn.hide()
+
+        self.pause_btn = QPushButton('Pause')
+        self.pause_btn.setCheckable(True)
+        self.pause_btn.setFixedWidth(self.pause_btn.fontMetrics().width('Resume') + 10)
+        self.pause_btn.toggled.connect(self.pause_renaming)
+        self.pause_btn.hide()
+
         self.progressbar = QProgressBar(parent=self)
+        # Phase, throughput and time left of the Renamer.
+        self.progress_label = QLabel(parent=self)
 
         self.bottom_bar_layout.addWidget(self.progressbar)
+        self.bottom_bar_layout.addWidget(self.progress_label)
+        self.bottom_bar_layout.addWidget(self.pause_btn)
+        self.bottom_bar_layout.addWidget(self.cancel_btn)
         self.bottom_bar_layout.addWidget(self.tagall_btn)
         self.bottom_bar_layout.addWidget(self.rename_btn)
         self.vertical_layout.addLayout(self.bottom_bar_layout)
 
-        self.renamer = Renamer(self.table, folder, self)
+        self.renamer = Renamer(workers=self.settings.get('write_workers', DEFAULT_WRITE_WORKERS),
+                               padding=self.settings.get('tag_padding', TAG_PADDING), parent=self)
         self.renamer.renamer_started.connect(self.started_renaming)
         self.renamer.renamer_update.connect(self.update_gui)
         self.renamer.finished.connect(self.rename_finished)
+        self.renaming_phase = ''
+
+        self.scanner = None
+        self.previewer = None
+
+        self.watcher = FolderWatcher(self)
+        self.watcher.changed.connect(self.sync_folder)
+        self.folder_sync = None
 
         bar = self.menuBar()
         file = bar.addMenu("File")
@@ -199,7 +148,20 @@ class GUI(QMainWindow):
         set_folder.triggered.connect(self.select_music_folder)
         log_opener = QAction('Open Log', self)
         log_opener.triggered.connect(self.open_log)
+        self.preview_action = QAction('Preview changes', self)
+        self.preview_action.triggered.connect(self.preview_changes)
+        revert = QAction('Revert last rename', self)
+        revert.triggered.connect(self.revert_last_rename)
+        edit_filter = QAction('Edit word filter', self)
+        edit_filter.triggered.connect(self.edit_word_filter)
+        watch = QAction('Watch folder for changes', self, checkable=True)
+        watch.setChecked(self.settings.get('watch_folder', False))
+        watch.toggled.connect(self.toggle_watcher)
         file.addAction(set_folder)
+        file.addAction(self.preview_action)
+        file.addAction(revert)
+        file.addAction(edit_filter)
+        file.addAction(watch)
         file.addAction(log_opener)
 
         about = bar.addMenu("Help")
@@ -212,10 +174,32 @@ class GUI(QMainWindow):
         self.logwindow.setFontPointSize(12)
         self.logwindow.setMinimumSize(800, 600)
 
+        self.previewwindow = QTextBrowser()
+        self.previewwindow.setWindowTitle('Preview changes')
+        self.previewwindow.setFont(QFont('consolas'))
+        self.previewwindow.setMinimumSize(800, 600)
+
         self.showMaximized()
 
+        if not self.resume_interrupted_rename():
+            self.log.debug('Fetching files and populating table...')
+            self.get_names()
+
     def closeEvent(self, *args, **kwargs):
         self.logwindow.close()  # Ensure log is closed
+        self.previewwindow.close()
+        self.cancel_scan()
+        self.watcher.stop()
+        if self.renamer.isRunning():
+            # Renames stop where no file is left with a temporary name, the cancelled batch can be reverted later.
+            self.renamer.cancel()
+            self.renamer.wait()
+        if self.scanner is not None:
+            self.scanner.wait()
+        if self.folder_sync is not None:
+            self.folder_sync.wait()
+        if self.previewer is not None:
+            self.previewer.wait()
         super(GUI, self).closeEvent(*args, **kwargs)
 
     def open_log(self):
@@ -225,6 +209,25 @@ class GUI(QMainWindow):
 
             self.logwindow.show()
 
+    def preview_changes(self):
+        """ Shows what 'Rename songs' would do, without writing to any file. The tags are read by a Previewer. """
+        if self.previewer is not None:
+            self.previewer.deleteLater()
+        self.preview_action.setDisabled(True)
+        self.previewer = Previewer(self.table.model().rename_plan(self.folder_path), self)
+        self.previewer.previewed.connect(self.show_preview)
+        self.previewer.start()
+
+    def show_preview(self, tags, renames, failed):
+        self.preview_action.setDisabled(False)
+        lines = [f'{len(tags)} tags and {len(renames)} renames.', '']
+        lines.extend(f'Tag "{path}": {artist} - {title}' for path, title, artist in tags)
+        lines.extend(f'Rename "{old_path}" to "{new_path}"' for old_path, new_path in renames)
+        lines.extend(f'Failed to read tags of "{path}"' for path in failed)
+
+        self.previewwindow.setPlainText('\n'.join(lines))
+        self.previewwindow.show()
+
     def select_music_folder(self):
         temp_path = QFileDialog.getExistingDirectory()
         if not temp_path:
@@ -233,14 +236,11 @@ class GUI(QMainWindow):
                                     'Do you want to load a new folder?', True)
         if result == QMessageBox.Yes:
             self.folder_path = self.settings['folder'] = temp_path
-            self.rename_finished(0, True)
+            self.table.folder_path = temp_path
+            self.reload_folder()
 
     def tag_all_songs(self):
-        items = []
-        for row in range(self.table.rowCount()):
-            items.append(self.table.item(row, 1))
-
-        self.table.create_tag([cell for cell in items if cell.column() == 1])
+        self.table.create_tag(self.table.model().row_ids())
 
     @staticmethod
     def resource_path(relative_path):
@@ -279,152 +279,271 @@ class GUI(QMainWindow):
 
         return warning_window.exec()
 
-    def rename_finished(self, results, skip_results=False):
-        if not skip_results:
-            self.alert_message(*results)
-        # Reload table
-        self.table.blockSignals(True)
+    def reload_folder(self):
+        """ Clears the table and loads the music folder again. """
+        # Changes found for the old rows no longer apply. The sync is kept, so a running one is waited for on exit,
+        # and no new one starts before it's done.
+        if self.folder_sync is not None:
+            try:
+                self.folder_sync.synced.disconnect(self.apply_folder_sync)
+            except TypeError:
+                # Already disconnected by an earlier reload.
+                pass
         self.log.debug('Clearing table')
-        self.table.clearContents()
-        self.table.setRowCount(0)
+        self.table.model().clear()
+        self.table.setDisabled(False)
+        self.progressbar.reset()
+        self.progress_label.clear()
         self.log.debug('Getting files in folder.')
         self.get_names()
-        self.log.debug('Resizing to contents.')
-        self.table.resizeColumnsToContents()
-        self.table.resizeRowsToContents()
 
-        horizontal_header = self.table.horizontalHeader()
-        horizontal_header.setSectionResizeMode(0, QHeaderView.Stretch)
-        horizontal_header.setSectionResizeMode(1, QHeaderView.Stretch)
+    def rename_finished(self, results, outcome):
+        """
+        Shows the results of the Renamer, and updates the rows it changed.
+        The folder is loaded again if the table can't be updated, like after a revert.
+        """
+        self.hide_rename_controls()
+        self.alert_message(*results)
+        self.log.debug('File renaming complete!\n{}'.format('-' * 40))
 
-        self.table.blockSignals(False)
-        if not skip_results:
-            self.log.debug('File renaming complete!\n{}'.format('-' * 40))
+        if outcome is None or outcome.reload:
+            self.reload_folder()
+            return
+
+        self.table.model().apply_rename_result(outcome)
+        self.log.debug(f'Updated {len(outcome.renamed)} renamed and {len(outcome.tagged)} tagged rows.')
 
         self.table.setDisabled(False)
         self.progressbar.reset()
+        self.progress_label.clear()
         self.rename_btn.setDisabled(False)
+        self.tagall_btn.setDisabled(False)
 
-    def started_renaming(self, current, total):
+    def started_renaming(self, phase, total):
+        self.renaming_phase = phase
         self.progressbar.setRange(0, total)
-        self.progressbar.setValue(current)
-
-    def update_gui(self, value):
-        self.progressbar.setValue(value)
+        self.progressbar.setValue(0)
+        self.progress_label.setText(f'{phase}: 0/{total}')
+
+    def update_gui(self, done, rate, eta):
+        self.progressbar.setValue(done)
+        text = f'{self.renaming_phase}: {done}/{self.progressbar.maximum()}, {rate:.0f} files/s'
+        if eta >= 0 and done < self.progressbar.maximum():
+            text += f', {int(eta) // 60}:{int(eta) % 60:02} left'
+        self.progress_label.setText(text)
+
+    def show_rename_controls(self):
+        self.pause_btn.setChecked(False)
+        self.pause_btn.setDisabled(False)
+        self.pause_btn.show()
+        self.cancel_btn.setText('Cancel renaming')
+        self.cancel_btn.setDisabled(False)
+        self.cancel_btn.show()
+
+    def hide_rename_controls(self):
+        self.pause_btn.hide()
+        self.cancel_btn.hide()
+        self.cancel_btn.setText('Cancel loading')
+
+    def pause_renaming(self, paused):
+        self.pause_btn.setText('Resume' if paused else 'Pause')
+        self.renamer.set_paused(paused)
+
+    def cancel_work(self):
+        """ Cancels the running rename, or the loading of the folder. """
+        if self.renamer.isRunning():
+            self.log.debug('Cancelling renaming.')
+            self.cancel_btn.setDisabled(True)
+            self.pause_btn.setDisabled(True)
+            self.renamer.cancel()
+        else:
+            self.cancel_scan()
 
     def write_to_files(self):
         self.log.debug('Disabling table!')
         self.table.setDisabled(True)
         self.rename_btn.setDisabled(True)
+        self.renamer.plan = self.table.model().rename_plan(self.folder_path)
+        self.show_rename_controls()
         self.renamer.start()
 
+    def replay_journal(self, batch, revert=False):
+        """ Resumes or reverts a batch of renames from the rename journal, the table is reloaded when done. """
+        self.cancel_scan()
+        if self.scanner is not None:
+            self.scanner.wait()
+        self.table.setDisabled(True)
+        self.rename_btn.setDisabled(True)
+        self.tagall_btn.setDisabled(True)
+        self.renamer.replay_journal(batch, revert)
+        self.show_rename_controls()
+        self.renamer.start()
+
+    def resume_interrupted_rename(self):
+        """
+        Asks to resume the last rename if the program was closed before it finished.
+        :return: If the rename was resumed.
+        """
+        batch = self.renamer.journal.unfinished()
+        if batch is None:
+            return False
+
+        result = self.alert_message('Unfinished rename!',
+                                    'The last rename was stopped before it finished.',
+                                    f'{len(batch.done)} of {len(batch.planned)} files in "{batch.folder}" were '
+                                    f'renamed. Do you want to rename the rest?', True)
+        if result == QMessageBox.Yes:
+            self.replay_journal(batch)
+            return True
+
+        self.renamer.journal.abandon(batch)
+        return False
+
+    def revert_last_rename(self):
+        if self.renamer.isRunning():
+            return
+
+        batch = self.renamer.journal.last_batch()
+        if batch is None:
+            self.alert_message('Nothing to revert!', 'There is no rename to revert.', None)
+            return
+
+        result = self.alert_message('Revert last rename?',
+                                    f'{len(batch.done) - len(batch.undone)} files in "{batch.folder}" will get their '
+                                    f'old names back.',
+                                    'Any unwritten changes will be lost! Do you want to continue?', True)
+        if result == QMessageBox.Yes:
+            self.replay_journal(batch, revert=True)
+
     def get_names(self):
         """
-        path = folder path + name + extension
-        file = name + extension
+        Starts loading the files of the music folder in the background.
+        Rows are added to the table by add_rows as the scanner finds them.
         """
-        old_col, new_col, ext_col, title_col, artist_col = range(5)
-        row = 0
-        # max_files = -1
-
-        # self.items.insertRow(0)
-        self.table.blockSignals(True)
-
-        # folder = os.listdir(self.folder_path)
-
-        folder = sorted(os.listdir(self.folder_path), key=lambda x: os.path.getctime(os.path.join(self.folder_path, x)))
-
-        # if len(folder) > 500:
-        #     result = self.alert_message('Note!', 'This folder has a lot of files',
-        #                                 'Do you only want to load all of them?', True, True)
-        #
-        #     if result == QMessageBox.Cancel:
-        #         sys.exit(0)
-        #
-        #     elif result == QMessageBox.No:
-        #         max_files = self.get_max_files()
-        #     elif result == QMessageBox.Yes:
-        #         pass
-        #     else:
-        #         log.warning('Unexpected response from dialog!')
-
-        for file in reversed(folder):
-            path = os.path.join(self.folder_path, file)
-            if not os.path.isfile(path):
-                self.log.info(f'Ignored folder: {file}')
-                continue
-
-            name, ext = os.path.splitext(file)
-            ext = ext[1:]
-            if ext.lower() not in ('mp3', 'wav', 'flac', 'ogg'):
-                continue
-
-            # TODO: Introduce a supported files list
-
-            title_item = TableWidgetItem('')
-            artist_item = TableWidgetItem('')
-
-            artist_item.setFlags(artist_item.flags() ^ Qt.ItemIsEditable)
-            title_item.setFlags(title_item.flags() ^ Qt.ItemIsEditable)
+        if self.scanner is not None:
+            self.cancel_scan()
+            self.scanner.wait()
+            self.scanner.deleteLater()
 
-            try:
-                meta = EasyID3(path)
-                if meta.keys():
-                    if 'title' in meta.keys():
-                        title_item.setText(meta['title'][0])
-                    if 'artist' in meta.keys():
-                        artist_item.setText(meta['artist'][0])
-                else:
-                    pass
-                    # has_id_item.setBackground(QColor)
-            except mutagen.id3.ID3NoHeaderError as e:
-                self.log.info(e)
-            except KeyError as e:
-                self.log.info(f'{file} has no title/artist in tag.')
-
-            self.table.insertRow(row)
-
-            # Old column
-            old_item = TableWidgetItem(name)
-            old_item.setFlags(old_item.flags() ^ Qt.ItemIsEditable)
-
-            # New column
-            new_name = self.word_filter(name)
-            new_name = capitalize(new_name)
-            new_filename = ''.join((new_name, '.', ext))
-
-            count = 1
-            if new_filename != file:
-                while new_filename in folder:
-                    self.log.info(f'New name already exists for {new_filename}')
-                    new_name = f'{new_name} ({count})'
-                    new_filename = ''.join((new_name, '.', ext))
-                    count += 1
-
-            new_item = TableWidgetItem(new_name)
-            new_item.setData(TableWidget.HANDLED_STATE, TableWidget.UNHANDLED)
-            # If a box was added.
-            if new_name.count(' - ') != 1 or count > 1:
-                new_item.setBackground(QColor('#e38c00'))
-
-            # Extension column
-            extension_item = TableWidgetItem(ext.upper())
-            extension_item.setTextAlignment(Qt.AlignCenter)
-            extension_item.setFlags(extension_item.flags() ^ Qt.ItemIsEditable)
-
-            # Inserting to table
-            self.table.setItem(row, old_col, old_item)
-            self.table.setItem(row, new_col, new_item)
-            self.table.setItem(row, ext_col, extension_item)
-            self.table.setItem(row, title_col, title_item)
-            self.table.setItem(row, artist_col, artist_item)
-
-            row += 1
-            # if row == max_files:
-            #     break
-
-        self.table.blockSignals(False)
-        return row
+        self.rename_btn.setDisabled(True)
+        self.tagall_btn.setDisabled(True)
+        self.cancel_btn.setDisabled(False)
+        self.cancel_btn.show()
+
+        # A new scanner per load, so batches still queued from an old scan can be told apart.
+        self.scanner = Scanner(self.folder_path, self.word_filter,
+                               self.settings.get('tag_workers', DEFAULT_TAG_WORKERS), self.rules, self)
+        self.scanner.scanner_started.connect(self.started_scanning)
+        self.scanner.scanner_update.connect(self.add_rows)
+        self.scanner.finished.connect(self.scan_finished)
+        self.scanner.start()
+
+        if self.settings.get('watch_folder', False):
+            self.watcher.watch(self.folder_path)
+
+    def edit_word_filter(self):
+        """ Lets the user edit the word filter, and gives new names to the rows it changes. """
+        dialog = FilterDialog(self.word_filter.get_replace_dict(), self.word_filter.get_base_dict(), self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+
+        replace_dict = dialog.get_filter()
+        if replace_dict == self.word_filter.get_replace_dict():
+            return
+
+        old_filter, self.word_filter = self.word_filter, WordFilter(replace_dict)
+        if replace_dict == self.word_filter.get_base_dict():
+            self.settings.pop('word_filter', None)
+        else:
+            self.settings['word_filter'] = replace_dict
+        if not FileHandler().save_settings(self.settings):
+            self.log.warning('Failed to save the word filter to the settings.')
+
+        # A running scan suggests names with the old filter, so the folder is loaded again with the new one.
+        if self.scanner is not None and self.scanner.isRunning():
+            self.reload_folder()
+        else:
+            self.table.refilter(old_filter, self.word_filter)
+
+    def toggle_watcher(self, checked):
+        self.settings['watch_folder'] = checked
+        if checked:
+            self.watcher.watch(self.folder_path)
+        else:
+            self.watcher.stop()
+
+    def sync_folder(self):
+        """
+        Updates the table with the files that were added, removed or changed in the folder, without reloading it.
+        Names and tags edited in the table are kept.
+        """
+        if (self.scanner is not None and self.scanner.isRunning()) or self.renamer.isRunning() or \
+                (self.folder_sync is not None and self.folder_sync.isRunning()):
+            self.watcher.postpone()
+            return
+
+        if self.folder_sync is not None:
+            self.folder_sync.deleteLater()
+
+        model = self.table.model()
+        self.folder_sync = FolderSync(self.folder_path, model.files(), model.removed_files(), model.new_filenames(),
+                                      self.word_filter, self.settings.get('tag_workers', DEFAULT_TAG_WORKERS),
+                                      self.rules, self)
+        self.folder_sync.synced.connect(self.apply_folder_sync)
+        self.folder_sync.start()
+
+    def apply_folder_sync(self, rows, missing, updates):
+        if self.sender() is not self.folder_sync:
+            return
+        if self.renamer.isRunning():
+            # The files are being renamed, what was found might not be true anymore.
+            self.watcher.postpone()
+            return
+
+        model = self.table.model()
+        model.remove_rows(missing)
+        # Newest files are shown first.
+        model.insert_rows(0, rows)
+        model.update_tags(updates)
+        self.log.debug(f'Folder synced, {len(rows)} rows added, {len(missing)} removed and {len(updates)} updated.')
+
+    def cancel_scan(self):
+        if self.scanner is not None and self.scanner.isRunning():
+            self.log.debug('Cancelling scan.')
+            self.cancel_btn.setDisabled(True)
+            self.scanner.requestInterruption()
+
+    def started_scanning(self, total):
+        if self.sender() is not self.scanner:
+            return
+        self.progressbar.setRange(0, total)
+        self.progressbar.setValue(0)
+
+    def add_rows(self, rows, done):
+        """
+        Inserts a batch of rows from the scanner at the bottom of the table.
+        A row is a tuple of (old name, new name, extension, title, artist, flagged, file version).
+        """
+        if self.sender() is not self.scanner:
+            return
+        self.table.model().append_rows(rows)
+        self.progressbar.setValue(done)
+
+    def scan_finished(self, rows, cancelled):
+        if self.sender() is not self.scanner:
+            return
+        self.log.debug(f'Table populated with {rows} files.')
+        self.table.resizeColumnsToContents()
+
+        horizontal_header = self.table.horizontalHeader()
+        horizontal_header.setSectionResizeMode(0, QHeaderView.Stretch)
+        horizontal_header.setSectionResizeMode(1, QHeaderView.Stretch)
+        self.log.debug('Table resized to contents')
+
+        self.cancel_btn.hide()
+        self.progressbar.reset()
+        self.rename_btn.setDisabled(False)
+        self.tagall_btn.setDisabled(False)
 
     def get_max_files(self):
         dialog = Dialog(self, 'How many?', 'Select the number of files you want to load!')
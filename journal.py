@@ -0,0 +1,287 @@
+import json
+import os
+import time
+
+from renaming import is_temp_path
+from utils import get_logger, RENAME_JOURNAL_FILE
+
+log = get_logger('Tagger.journal')
+
+
+class JournalBatch:
+    """ One rename run, as read back from the journal. """
+    __slots__ = ('id', 'kind', 'folder', 'reverts', 'planned', 'done', 'undone', 'finished', 'reverted')
+
+    def __init__(self, batch_id, kind, folder, reverts=None):
+        self.id = batch_id
+        self.kind = kind
+        self.folder = folder
+        # The id of the batch a revert batch undoes.
+        self.reverts = reverts
+        # (old path, new path) of each rename, in the order they were planned and done.
+        self.planned = []
+        self.done = []
+        # The renames of this batch undone by cancelled reverts.
+        self.undone = []
+        self.finished = False
+        self.reverted = False
+
+    def remaining(self):
+        """ The planned renames that are not recorded as done. """
+        done = set(self.done)
+        return [step for step in self.planned if step not in done]
+
+
+class RenameJournal:
+    """
+    An append-only file of the renames that are planned and done, one JSON record per line.
+    The plan of a batch is synced to disk before the first file is renamed, and the done renames every
+    sync_every renames, so an interrupted run can be resumed, and the last run can be reverted without a rescan.
+
+    A batch is written by one thread at a time.
+    If the journal can't be written, like when the disk is full, it disables itself for the rest of the batch,
+    and renaming goes on without it.
+    """
+    SYNC_EVERY = 100
+    # Older batches are dropped from the journal when a new one starts.
+    KEEP_BATCHES = 20
+
+    def __init__(self, path=RENAME_JOURNAL_FILE, sync_every=SYNC_EVERY):
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self._file = None
+        self._batch = None
+        self._unsynced = 0
+        self._disabled = False
+
+    def _records(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # The last line is cut off if the program died while writing it.
+                        continue
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            log.warning(f'Failed to read the rename journal "{self.path}": {e}')
+            return
+
+    def batches(self):
+        """ Reads all batches in the journal, oldest first. """
+        batches = {}
+        for record in self._records():
+            op, batch_id = record.get('op'), record.get('batch')
+            if op == 'begin':
+                batches[batch_id] = JournalBatch(batch_id, record['kind'], record['folder'], record.get('reverts'))
+                continue
+
+            batch = batches.get(batch_id)
+            if batch is None:
+                continue
+            if op == 'plan':
+                batch.planned.append((record['from'], record['to']))
+            elif op == 'done':
+                batch.done.append((record['from'], record['to']))
+                if batch.kind == 'revert' and batch.reverts in batches:
+                    batches[batch.reverts].undone.append((record['to'], record['from']))
+            elif op == 'end':
+                batch.finished = True
+                if batch.kind == 'revert' and batch.reverts in batches and not record.get('cancelled'):
+                    batches[batch.reverts].reverted = True
+
+        return list(batches.values())
+
+    def unfinished(self):
+        """ The last batch if the program stopped before it was finished, otherwise None. """
+        batches = self.batches()
+        if batches and not batches[-1].finished:
+            return batches[-1]
+        return None
+
+    def last_batch(self):
+        """ The last finished rename batch that renamed anything and hasn't been reverted, or None. """
+        for batch in reversed(self.batches()):
+            if batch.kind == 'revert' or batch.reverted:
+                continue
+            if batch.finished and not batch.done:
+                # Nothing was renamed, like when only tags were written.
+                continue
+            return batch if batch.finished else None
+        return None
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def _error(self, error):
+        log.warning(f'Rename journal disabled for this batch, failed to write "{self.path}": {error}')
+        self._disabled = True
+        self._unsynced = 0
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _write(self, record, sync=False):
+        if self._disabled:
+            return
+        try:
+            self._open().write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            self._error(e)
+            return
+        self._unsynced += 1
+        if sync or self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """ Makes sure everything written so far is on disk. """
+        if self._file is not None and self._unsynced:
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                self._error(e)
+                return
+            self._unsynced = 0
+
+    def _compact(self, batches):
+        """ Rewrites the journal with only the newest batches. """
+        keep = {batch.id for batch in batches[-(self.KEEP_BATCHES - 1):]} if self.KEEP_BATCHES > 1 else set()
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in self._records():
+                if record.get('batch') in keep:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def begin(self, renames, folder, kind='rename', reverts=None):
+        """
+        Starts a batch, and writes its planned renames.
+
+        :param renames: The (old path, new path) of each rename, in the order they will be done.
+        :return: The id of the new batch.
+        """
+        self.close()
+        self._disabled = False
+        batches = self.batches()
+        if len(batches) >= self.KEEP_BATCHES:
+            try:
+                self._compact(batches)
+            except OSError as e:
+                log.warning(f'Failed to compact the rename journal: {e}')
+
+        self._batch = max((batch.id for batch in batches), default=0) + 1
+        record = {'op': 'begin', 'batch': self._batch, 'kind': kind, 'folder': folder, 'time': time.time()}
+        if reverts is not None:
+            record['reverts'] = reverts
+        self._write(record)
+        for old_path, new_path in renames:
+            self._write({'op': 'plan', 'batch': self._batch, 'from': old_path, 'to': new_path})
+        self.sync()
+
+        log.info(f'Journal batch {self._batch} started, {len(renames)} renames planned.')
+        return self._batch
+
+    def begin_revert(self, batch: JournalBatch):
+        """
+        Starts a batch that undoes the renames of another batch, newest first.
+        Renames undone by a cancelled revert are skipped.
+
+        :return: The (old path, new path) of each rename to do.
+        """
+        undone = set(batch.undone)
+        renames = [(new_path, old_path) for old_path, new_path in reversed(batch.done)
+                   if (old_path, new_path) not in undone]
+        self.begin(renames, batch.folder, 'revert', batch.id)
+        return renames
+
+    def resume(self, batch: JournalBatch):
+        """
+        Continues an unfinished batch. Renames that happened after the last sync, but weren't recorded,
+        are found by checking the files.
+
+        :return: The (old path, new path) of each rename left to do.
+        """
+        self.close()
+        self._disabled = False
+        self._batch = batch.id
+
+        # Renames are done in order, so everything up to the last one that looks done was already tried.
+        # Renames to and from temporary names are synced when done, so a file can only have been moved on from
+        # a temporary name that is in the journal.
+        remaining = batch.remaining()
+        parked = {os.path.normcase(new_path) for old_path, new_path in batch.done if is_temp_path(new_path)}
+        tried = 0
+        for idx, (old_path, new_path) in enumerate(remaining):
+            if is_temp_path(old_path) and os.path.normcase(old_path) not in parked:
+                continue
+            if not os.path.lexists(old_path) and os.path.lexists(new_path):
+                tried = idx + 1
+
+        # A name can be taken again by a later rename, or moved on from like a temporary name, so the tried
+        # renames are checked newest first, against the files as they were right after each of them.
+        exists = {}
+
+        def lexists(path):
+            key = os.path.normcase(path)
+            return exists[key] if key in exists else os.path.lexists(path)
+
+        done = []
+        for old_path, new_path in reversed(remaining[:tried]):
+            if is_temp_path(old_path) and os.path.normcase(old_path) not in parked:
+                continue
+            if lexists(new_path) and not lexists(old_path):
+                done.append((old_path, new_path))
+                exists[os.path.normcase(new_path)] = False
+                exists[os.path.normcase(old_path)] = True
+        for old_path, new_path in reversed(done):
+            self.done(old_path, new_path)
+        remaining = remaining[tried:]
+        self.sync()
+
+        log.info(f'Journal batch {batch.id} resumed, {len(remaining)} renames left.')
+        return remaining
+
+    def abandon(self, batch: JournalBatch):
+        """ Marks an unfinished batch as finished without doing the rest of it, what was done can be reverted. """
+        self.close()
+        self._disabled = False
+        self._batch = batch.id
+        self.finish()
+        log.info(f'Journal batch {batch.id} abandoned, {len(batch.done)} of {len(batch.planned)} renames done.')
+
+    def done(self, old_path, new_path):
+        """ Records a finished rename of the current batch. """
+        self._write({'op': 'done', 'batch': self._batch, 'from': old_path, 'to': new_path})
+
+    def finish(self, cancelled=False):
+        """
+        Marks the current batch as finished, and closes the journal.
+        :param cancelled: If the batch was stopped before all of it was done. A cancelled revert can be continued.
+        """
+        if self._batch is not None:
+            record = {'op': 'end', 'batch': self._batch, 'time': time.time()}
+            if cancelled:
+                record['cancelled'] = True
+            self._write(record, sync=True)
+            self._batch = None
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as e:
+                log.warning(f'Failed to close the rename journal "{self.path}": {e}')
+            self._file = None
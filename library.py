@@ -0,0 +1,199 @@
+import os
+
+import mutagen
+import mutagen.mp3
+from mutagen.easyid3 import EasyID3
+
+from filters import WordFilter
+from renaming import file_version
+from utils import get_logger
+
+log = get_logger('Tagger.library')
+
+SUPPORTED_FORMATS = ('mp3', 'wav', 'flac', 'ogg')
+# Reading tags mostly waits on the disk or network, so a few more threads than cores pay off.
+DEFAULT_TAG_WORKERS = 8
+
+
+def split_extension(file):
+    """ Returns the name and the extension (without the dot) of a filename. """
+    name, ext = os.path.splitext(file)
+    return name, ext[1:]
+
+
+def scan_folder(folder_path):
+    """
+    Lists the supported music files of a folder in a single pass, newest first.
+    Uses os.scandir, so the file type check is free on most platforms, and each file is stat'ed
+    once. The stat result is cached on the returned DirEntry objects for later use.
+
+    :return: A list of DirEntry for the music files, and a list with the names of everything in the folder.
+    """
+    entries = []
+    names = []
+
+    with os.scandir(folder_path) as folder:
+        for entry in folder:
+            names.append(entry.name)
+
+            try:
+                if not entry.is_file():
+                    log.debug('Ignored folder: %s', entry.name)
+                    continue
+            except OSError:
+                continue
+
+            if split_extension(entry.name)[1].lower() not in SUPPORTED_FORMATS:
+                continue
+
+            try:
+                # Caches the stat result on the entry.
+                entry.stat()
+            except OSError as e:
+                log.warning(f'Failed to read file info for {entry.name}: {e}')
+                continue
+
+            entries.append(entry)
+
+    # Sorted oldest first and then reversed, so files with the same creation time keep their previous order.
+    entries.sort(key=lambda x: x.stat().st_ctime)
+    entries.reverse()
+
+    return entries, names
+
+
+def read_tags(path):
+    """
+    Reads the title and artist from the tag of a file. Safe to call from worker threads.
+
+    :return: The title and artist, or empty strings, and whether the file could be read at all.
+    """
+    title, artist = '', ''
+    try:
+        meta = EasyID3(path)
+        if meta.keys():
+            if 'title' in meta.keys():
+                title = meta['title'][0]
+            if 'artist' in meta.keys():
+                artist = meta['artist'][0]
+    except mutagen.id3.ID3NoHeaderError as e:
+        log.debug('%s', e)
+    except KeyError:
+        log.debug('%s has no title/artist in tag.', os.path.basename(path))
+    except Exception as e:
+        log.warning(f'Failed to read tags from {os.path.basename(path)}: {e}')
+        return title, artist, False
+
+    return title, artist, True
+
+
+def read_tags_cached(entries, pool, cache, interrupted=None):
+    """
+    Returns the (title, artist) of each entry from scan_folder, in order.
+    Tags of files that haven't changed since they were last read are taken from the tag cache,
+    the rest are read by the worker pool.
+
+    :param interrupted: Optional callable, files are skipped once it returns True.
+    """
+    def read_file(entry):
+        if interrupted is not None and interrupted():
+            return '', '', False
+        return read_tags(entry.path)
+
+    tags = [cache.get(entry.path, entry.stat()) for entry in entries]
+    misses = [entry for entry, cached in zip(entries, tags) if cached is None]
+
+    if misses:
+        results = iter(pool.map(read_file, misses))
+        for idx, cached in enumerate(tags):
+            if cached is None:
+                entry = entries[idx]
+                title, artist, readable = next(results)
+                if readable:
+                    # Files that failed to be read are not cached, they might be readable next time.
+                    cache.put(entry.path, entry.stat(), title, artist)
+                tags[idx] = title, artist
+
+    return tags
+
+
+class NameReservations:
+    """
+    The filenames that are taken in a folder, by files that already exist and by the new names suggested
+    so far in the same scan. Keep one per scan, so two new names never end up the same.
+    Names are compared like the file system does, case insensitive on Windows.
+    """
+
+    def __init__(self, names=()):
+        self.taken = {os.path.normcase(name) for name in names}
+        # The next number to try for a name that collided before, so repeated names don't count up from 1 again.
+        self.counters = {}
+
+    def reserve(self, file, new_name, ext):
+        """
+        Reserves the new name of a file, with a number added if the name is already taken.
+
+        :return: The new name without extension, and if a number was added to it.
+        """
+        new_filename = ''.join((new_name, '.', ext))
+        key = os.path.normcase(new_filename)
+
+        # A file keeping its name, or only changing its case, doesn't collide with itself.
+        if key == os.path.normcase(file) or key not in self.taken:
+            self.taken.add(key)
+            return new_name, False
+
+        log.debug('New name already exists for %s', new_filename)
+        count = self.counters.get(key, 1)
+        while True:
+            numbered = f'{new_name} ({count})'
+            numbered_key = os.path.normcase(''.join((numbered, '.', ext)))
+            count += 1
+            if numbered_key not in self.taken:
+                break
+
+        self.counters[key] = count
+        self.taken.add(numbered_key)
+        return numbered, True
+
+
+def suggest_names(files, reserved: NameReservations, word_filter: WordFilter, rules=None):
+    """
+    Creates the new names of files, with the word filter and capitalization applied to all names in one batch.
+    A number is added to a name if another file in the folder already has it, or was given it earlier.
+
+    :param reserved: The names taken in the folder, the new names are added to it.
+    :param rules: Optional rules from rules.compile_rules, applied after the word filter.
+    :return: The new name of each file without extension, and if it should be highlighted in the table.
+    """
+    names, extensions = zip(*map(split_extension, files)) if files else ((), ())
+    new_names = word_filter.normalize_all(list(names))
+    if rules is not None:
+        new_names = list(map(rules, new_names))
+    return [_number_name(file, new_name, ext, reserved) for file, new_name, ext in zip(files, new_names, extensions)]
+
+
+def create_rows(entries, tags, reserved: NameReservations, word_filter: WordFilter, rules=None):
+    """
+    Creates the table rows of music files found by scan_folder.
+    A row is a tuple of (old name, new name, extension, title, artist, flagged, file version).
+
+    :param tags: The (title, artist) of each entry, see read_tags_cached.
+    :param reserved: The names taken in the folder, the new names are added to it.
+    :param rules: Optional rules from rules.compile_rules, applied to the new names.
+    """
+    rows = []
+    new_names = suggest_names([entry.name for entry in entries], reserved, word_filter, rules)
+    for entry, (new_name, flagged), (title, artist) in zip(entries, new_names, tags):
+        name, ext = split_extension(entry.name)
+        rows.append((name, new_name, ext.upper(), title, artist, flagged, file_version(entry.stat())))
+    return rows
+
+
+def _number_name(file, new_name, ext, reserved):
+    new_name, numbered = reserved.reserve(file, new_name, ext)
+
+    # Highlighted if there is no clear title/artist split, or if a number was added.
+    flagged = new_name.count(' - ') != 1 or numbered
+
+    return new_name, flagged
@@ -1,190 +1,215 @@
 import os
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-import mutagen
-import mutagen.mp3
 from PyQt5.QtCore import *
-from PyQt5.QtWidgets import *
-from mutagen.easyid3 import EasyID3
 
-from utils import get_logger
+from journal import RenameJournal, JournalBatch
+from renaming import save_tags_concurrently, apply_renames, is_temp_path, file_version, RenamePlan, RenameResult, \
+    TagWriteStats, DEFAULT_WRITE_WORKERS, TAG_PADDING
+from tag_cache import TagCache
+from utils import get_logger, ProgressMeter
 
 
 class Renamer(QThread):
+    """
+    Tags and renames files from a RenamePlan. The plan is made by the GUI before the thread is started,
+    the thread never touches the table.
+    Both phases can be paused, and cancelled with requestInterruption, see cancel. A cancelled run reports what it did.
+    """
     error = pyqtSignal(str)
-    renamer_started = pyqtSignal(int, int)
-    renamer_update = pyqtSignal(int)
-    finished = pyqtSignal(tuple)
-
-    def __init__(self, table, folder_path, parent=None):
+    # The name of the phase, and the number of files in it.
+    renamer_started = pyqtSignal(str, int)
+    # Files done in the phase, files per second and seconds left, or -1 if not known. Throttled by ProgressMeter.
+    renamer_update = pyqtSignal(int, float, float)
+    # The title, text and info of the results message, and the RenameResult, or None if the folder has to be reloaded.
+    finished = pyqtSignal(tuple, object)
+
+    def __init__(self, plan: RenamePlan = None, workers=DEFAULT_WRITE_WORKERS, padding=TAG_PADDING, parent=None):
         super(Renamer, self).__init__(parent)
         self.log = get_logger('Tagger.renamer')
-        self.table = table
-        self.folder_path = folder_path
+        self.plan = plan
+        self.workers = max(1, workers)
+        self.padding = padding
+        # Paths of the files that failed to be tagged in the last run.
+        self.tag_errors = []
+        # How the tags of the last run were written.
+        self.tag_stats = TagWriteStats()
+        self.journal = RenameJournal()
+        # A journal batch to resume or revert instead of running the plan, see replay_journal.
+        self.replay = None
+        self.revert = False
+        self.cache = TagCache()
+        self.paused = False
+        self.pause_lock = QMutex()
+        self.unpaused = QWaitCondition()
         self.log.info('Rename thread initialized')
 
-    def write_tags_to_files(self):
+    def set_paused(self, paused):
+        self.pause_lock.lock()
+        self.paused = paused
+        self.unpaused.wakeAll()
+        self.pause_lock.unlock()
+        self.log.info(f'Renaming {"paused" if paused else "resumed"}.')
+
+    def cancel(self):
+        """ Stops the run at the next file, a paused run is woken up to stop. """
+        self.requestInterruption()
+        self.pause_lock.lock()
+        self.unpaused.wakeAll()
+        self.pause_lock.unlock()
+        self.log.info('Renaming cancelled.')
+
+    def checkpoint(self):
+        """ Blocks while paused, returns False if the run is cancelled. Called by the tag workers too. """
+        self.pause_lock.lock()
+        while self.paused and not self.isInterruptionRequested():
+            self.unpaused.wait(self.pause_lock)
+        self.pause_lock.unlock()
+        return not self.isInterruptionRequested()
+
+    def write_tags_to_files(self, result: RenameResult):
         """
         Applying tags to files, before renaming them.
-        :return:
-        :rtype:
+        Tags are saved by a pool of worker threads, progress is counted as the saves finish.
+        :return: The number of tags written.
         """
+        tags_done = 0
         try:
-            tags_done = 0
-            saves = []
-            for row in range(self.table.rowCount()):
-                title, artist = self.table.item(row, 3).text(), self.table.item(row, 4).text()
-                if title == '' and artist == '':
-                    continue
-                file_ext = self.table.item(row, 2).text()
-                filename = ''.join((self.table.item(row, 0).text(), '.', file_ext.lower()))
-                path = os.path.join(self.folder_path, filename).replace('/', '\\')
-
-                try:
-                    meta = EasyID3(path)
-                except mutagen.id3.ID3NoHeaderError:
-                    meta = EasyID3()
-                except Exception as e:
-                    self.log.warning(f'Error happened when fetching metadata:\n{e}')
-                    continue
-
-                skip = False
-                try:
-                    if meta.keys():
-                        if 'title' in meta.keys():
-                            if title not in meta['title']:
-                                meta['title'] = title
-                            else:
-                                skip = True
-                        else:
-                            meta['title'] = title
-
-                        if 'artist' in meta.keys():
-                            if artist not in meta['artist']:
-                                meta['artist'] = artist
-                            else:
-                                if skip:
-                                    continue
+            saves, failed = self.plan.load_tags()
+            for path, entry in failed:
+                self.tag_errors.append(path)
+                result.add_tag(entry, False)
+
+            self.renamer_started.emit('Tagging', len(saves))
+            progress = ProgressMeter(len(saves))
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for path, entry, saved in save_tags_concurrently(saves, pool, self.tag_stats, self.padding,
+                                                                 self.checkpoint):
+                    if saved:
+                        tags_done += 1
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            result.add_tag(entry, True)
                         else:
-                            meta['artist'] = artist
+                            self.cache.put(path, stat, entry.title, entry.artist)
+                            result.add_tag(entry, True, file_version(stat))
                     else:
-                        meta['title'] = title
-                        meta['artist'] = artist
-                except Exception:
-                    self.log.warning(f'Error on setting tag for {path}')
-                    continue
-
-                saves.append((meta, path))
-
-            jobs = len(saves) * 2
-            self.renamer_started.emit(0, jobs)
-
-            tags_done = 0
-            for meta, path in saves:
-                try:
-                    meta.save(path)
-                    self.log.info(f'Tags saved for {path}')
-                except (PermissionError, mutagen.MutagenError):
-                    self.log.warning(f'Failed to save tags to file {path}')
-                finally:
-                    tags_done += 1
-                    self.renamer_update.emit(tags_done)
+                        self.tag_errors.append(path)
+                        result.add_tag(entry, False)
+                    if progress.step():
+                        self.renamer_update.emit(progress.done, progress.rate, progress.eta)
 
         except Exception as e:
             traceback.print_exc()
 
         return tags_done
 
-    def alert_message(self, title, text, info_text, question=False, allow_cancel=False):
-        warning_window = QMessageBox(parent=None)
-        warning_window.setText(text)
-        warning_window.setIcon(QMessageBox.Warning)
-        warning_window.setWindowTitle(title)
-
-        if info_text:
-            warning_window.setInformativeText(info_text)
-        if question and allow_cancel:
-            warning_window.setStandardButtons(QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
-        elif question:
-            warning_window.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-
-        return warning_window.exec()
+    def replay_journal(self, batch: JournalBatch, revert=False):
+        """ Sets the thread to resume an unfinished journal batch, or to revert a finished one, when started. """
+        self.replay = batch
+        self.revert = revert
 
     def run(self):
-        self.log.info('Starting renaming....\n{}'.format('-' * 40))
-        # Pre-process check:
-        renames = []
-        old_names = set()
-
-        tags_done = self.write_tags_to_files()
-
-        # Preparing the renaming!
-        # Creates a list with files to rename
-        for row in range(self.table.rowCount()):
-            file_ext = self.table.item(row, 2).text()
-            filename = ''.join((self.table.item(row, 0).text(), '.', file_ext.lower()))
-            new_filename = ''.join((self.table.item(row, 1).text(), '.', file_ext.lower()))
-
-            if new_filename == '.' or file_ext == '':
-                continue
-
-            # print('-   |'+new_filename)
-
-            if new_filename == filename:
-                # print('No changes needed!', filename, '->', new_filename)
-                # log.info(f'File "{filename}" has no changes!')
-                continue
-            else:
-                old_names.add(filename)
+        tags_done = 0
+        self.tag_errors = []
+        self.tag_stats = TagWriteStats()
+
+        result = None
+        if self.replay is None:
+            self.log.info('Starting renaming....\n{}'.format('-' * 40))
+            result = RenameResult(self.plan)
+            tags_done = self.write_tags_to_files(result)
+
+            # Preparing the renaming! Nothing is renamed if the tagging was cancelled.
+            renames = self.plan.renames() if not self.isInterruptionRequested() else []
+            listed = len(self.plan.entries)
+            self.journal.begin(renames, self.plan.folder_path)
+        elif self.revert:
+            self.log.info(f'Reverting rename batch {self.replay.id}....\n{"-" * 40}')
+            renames = self.journal.begin_revert(self.replay)
+            listed = len(renames)
+        else:
+            self.log.info(f'Resuming rename batch {self.replay.id}....\n{"-" * 40}')
+            renames = self.journal.resume(self.replay)
+            listed = len(self.replay.planned)
+        replay, revert = self.replay, self.revert
+        self.replay, self.revert = None, False
 
-            if new_filename in old_names:
-                self.log.info(
-                    f'File "{filename}" can\'t be renamed to "{new_filename}" since that name already exists!')
-                # print(f'{filename} does already exist!')
-                continue
-
-            old_path = os.path.join(self.folder_path, filename).replace('/', '\\')
-            new_path = os.path.join(self.folder_path, new_filename).replace('/', '\\')
-
-            renames.append((old_path, new_path))
         # Emit number of renames!
         rename_length = len(renames)
+        # Files moved to a temporary name are counted when they get their new name.
+        files = sum(not is_temp_path(new_path) for old_path, new_path in renames)
 
-        self.renamer_started.emit(rename_length, rename_length * 2)
+        self.renamer_started.emit('Renaming', rename_length)
+        progress = ProgressMeter(rename_length)
 
         errors = 0
-        step = rename_length
-        for file in renames:
-            try:
-                os.rename(file[0], file[1])
-                self.log.info(f'File successfully renamed: {file[0]} renamed to {file[1]}.')
-            except PermissionError as e:
-                errors += 1
-                self.log.warning(f'Error: Renaming failed. '
-                                 f'Did not get permission to edit file. Might be in use already.')
-                self.log.debug(f'Full error: {e}')
-                # traceback.print_exc()
-            except FileExistsError as e:
-                errors += 1
-                self.log.warning(f'Error: Renaming failed. File {file} already exists!')
-                self.log.debug(f'Full error: {e}')
-            except Exception as e:
+        files_done = 0
+        for old_path, new_path, renamed in apply_renames(renames, self.journal, self.checkpoint):
+            if result is not None:
+                result.add_rename(old_path, new_path, renamed)
+            if renamed:
+                self.cache.rename(old_path, new_path)
+                files_done += not is_temp_path(new_path)
+            else:
                 errors += 1
-                self.log.warning(f'An unexpected error was encountered renaming'
-                                 f' {file[0]} to {file[1]}, with error:\n{e}')
-                # print(e)
-                # traceback.print_exc()
-
-            # Emit progress
-            step += 1
-            self.renamer_update.emit(step)
-        # print('Done!', f"{len(renames)} songs renamed, out of {self.table.rowCount()}")
-        self.log.info(f'Renaming files complete, {rename_length - errors} of detected {rename_length} files renamed. '
-                      f'Total files in table: {self.table.rowCount()}. Errors: {errors}')
-
-        results = ('Renaming complete!',
-                   'Renaming operation has been completed.',
-                   f"{len(renames)-errors} songs has been renamed, out of {self.table.rowCount()} listed.\n"
-                   f"{tags_done} tags have been applied. Encountered a total of {errors} errors!")
-
-        self.finished.emit(results)
+
+            if progress.step():
+                self.renamer_update.emit(progress.done, progress.rate, progress.eta)
+        cancelled = self.isInterruptionRequested()
+        # A cancelled batch is finished too, what was renamed can be reverted.
+        self.journal.finish(cancelled)
+        self.cache.close()
+        if cancelled:
+            self.log.info(f'Renaming cancelled after {progress.done} of {rename_length} renames.')
+        self.log.info(f'Renaming files complete, {files_done} of detected {files} files renamed. '
+                      f'Total files in table: {listed}. Errors: {errors}')
+        if tags_done:
+            self.log.info(f'Tag writes: {self.tag_stats}')
+        if self.tag_errors:
+            self.log.warning(f'Failed to tag {len(self.tag_errors)} files:\n' + '\n'.join(self.tag_errors))
+
+        if replay is not None:
+            action = 'reverted' if revert else 'renamed'
+            if cancelled:
+                title, text = f'{"Revert" if revert else "Resume"} cancelled!', \
+                              f'Rename batch {replay.id} was only partly {"reverted" if revert else "finished"}.'
+            else:
+                title, text = f'{"Revert" if revert else "Resume"} complete!', \
+                              f'Rename batch {replay.id} has been {"reverted" if revert else "finished"}.'
+            results = (title, text,
+                       f'{files_done} of {files} songs have been {action}. '
+                       f'Encountered a total of {errors} errors!')
+            self.finished.emit(results, None)
+            return
+
+        info = (f"{files_done} songs has been renamed, out of {listed} listed.\n"
+                f"{tags_done} tags have been applied. Encountered a total of {errors + len(self.tag_errors)} errors!")
+        if tags_done:
+            info += f'\n{self.tag_stats}.'
+        if self.tag_errors:
+            info += f'\nFailed to tag {len(self.tag_errors)} files, see the log for which.'
+
+        if cancelled:
+            results = ('Renaming cancelled!', 'Renaming was cancelled, the files done so far keep their changes.', info)
+        else:
+            results = ('Renaming complete!',
+                       'Renaming operation has been completed.',
+                       info)
+
+        self.finished.emit(results, result)
+
+
+class Previewer(QThread):
+    """ Makes a dry run of a RenamePlan, so the tags of the files are read off the GUI thread. Writes nothing. """
+    # The (path, title, artist) of each tag, the (old path, new path) of each rename, and the paths that failed.
+    previewed = pyqtSignal(list, list, list)
+
+    def __init__(self, plan: RenamePlan, parent=None):
+        super(Previewer, self).__init__(parent)
+        self.plan = plan
+
+    def run(self):
+        self.previewed.emit(*self.plan.preview())
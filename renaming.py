@@ -0,0 +1,441 @@
+import os
+import threading
+from concurrent.futures import as_completed
+from typing import NamedTuple, Optional, Tuple
+
+import mutagen
+import mutagen.mp3
+from mutagen.easyid3 import EasyID3
+
+from utils import get_logger
+
+log = get_logger('Tagger.renaming')
+
+# Saving a tag mostly waits on the disk, or the network for shared folders. Kept low so spinning disks don't thrash.
+DEFAULT_WRITE_WORKERS = 4
+# Padding reserved when a tag outgrows its space, so later edits can be saved in place instead of rewriting the file.
+TAG_PADDING = 8 * 1024
+# Added to the name of a file that is moved out of the way during a rename.
+TEMP_SUFFIX = '.tagger-tmp'
+
+
+def file_version(stat):
+    """ The size and modification time of a file, these change whenever its tag is saved. """
+    return stat.st_size, stat.st_mtime_ns
+
+
+def tag_changes(path, title, artist):
+    """
+    Loads the tag of a file and sets the title and artist on it.
+    Errors reading the file are raised to the caller.
+
+    :return: The tag to save, or None if the file already has that title and artist.
+    """
+    try:
+        meta = EasyID3(path)
+    except mutagen.id3.ID3NoHeaderError:
+        meta = EasyID3()
+
+    skip = False
+    if meta.keys():
+        if 'title' in meta.keys():
+            if title not in meta['title']:
+                meta['title'] = title
+            else:
+                skip = True
+        else:
+            meta['title'] = title
+
+        if 'artist' in meta.keys():
+            if artist not in meta['artist']:
+                meta['artist'] = artist
+            elif skip:
+                return None
+        else:
+            meta['artist'] = artist
+    else:
+        meta['title'] = title
+        meta['artist'] = artist
+
+    return meta
+
+
+class TagWriteStats:
+    """
+    Counts how the tags of a run were written. A save is in place when the new tag fits in the space of the old one,
+    otherwise the whole file after the tag is moved, and so rewritten. Safe to share between worker threads.
+    """
+
+    def __init__(self):
+        self.in_place = 0
+        self.rewrites = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def add(self, rewritten, bytes_written):
+        with self._lock:
+            if rewritten:
+                self.rewrites += 1
+            else:
+                self.in_place += 1
+            self.bytes_written += bytes_written
+
+    def __str__(self):
+        return (f'{self.in_place} tags written in place, {self.rewrites} files rewritten, '
+                f'{self.bytes_written / 1024 ** 2:.1f} MiB written')
+
+
+def id3_size(path):
+    """ The size of the ID3v2 tag at the start of a file, including its padding, or 0 if it has none. """
+    with open(path, 'rb') as f:
+        header = f.read(10)
+
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+
+    size = 10 + ((header[6] & 0x7f) << 21 | (header[7] & 0x7f) << 14 | (header[8] & 0x7f) << 7 | header[9] & 0x7f)
+    if header[5] & 0x10:
+        # Footer
+        size += 10
+    return size
+
+
+def tag_padding(reserved=TAG_PADDING):
+    """
+    Returns a mutagen padding function that never makes the tag smaller, so tags that fit are saved in place.
+    When a tag has to grow, the file is rewritten once with a reserve of padding for later edits.
+    """
+    def padding(info):
+        if info.padding >= 0:
+            return info.padding
+        return max(reserved, info.get_default_padding())
+
+    return padding
+
+
+def save_tags(meta, path, stats: TagWriteStats = None, padding=TAG_PADDING):
+    """
+    Writes a tag to a file, returns if it succeeded.
+
+    :param stats: Optional TagWriteStats to count the save in.
+    :param padding: The bytes of padding to reserve when a tag doesn't fit, 0 to leave it to mutagen.
+    """
+    try:
+        old_size = id3_size(path) if stats is not None else 0
+        meta.save(path, padding=tag_padding(padding) if padding else None)
+
+        if stats is not None:
+            new_size = id3_size(path)
+            if new_size == old_size:
+                stats.add(False, new_size)
+            else:
+                # Everything after the tag was moved.
+                stats.add(True, os.path.getsize(path))
+
+        log.debug('Tags saved for %s', path)
+        return True
+    except (OSError, mutagen.MutagenError):
+        log.warning(f'Failed to save tags to file {path}')
+        return False
+
+
+def _checked_save(meta, path, stats, padding, checkpoint):
+    """ Saves a tag if the checkpoint allows it, returns None if it was skipped. """
+    if checkpoint is not None and not checkpoint():
+        return None
+    return save_tags(meta, path, stats, padding)
+
+
+def save_tags_concurrently(saves, pool, stats: TagWriteStats = None, padding=TAG_PADDING, checkpoint=None):
+    """
+    Writes tags with a worker pool.
+
+    :param saves: The (tag, path, entry) of each tag to save, as from RenamePlan.load_tags.
+    :param stats: Optional TagWriteStats to count the saves in, see save_tags.
+    :param checkpoint: Optional callable the workers call before each save. It may block to pause the saves,
+                       and returns False to skip the rest of them.
+    :return: A generator of (path, entry, saved) in the order the saves finish. Skipped saves are left out.
+    """
+    futures = {pool.submit(_checked_save, meta, path, stats, padding, checkpoint): (path, entry)
+               for meta, path, entry in saves}
+    try:
+        for future in as_completed(futures):
+            path, entry = futures[future]
+            try:
+                saved = future.result()
+                if saved is None:
+                    continue
+            except Exception as e:
+                log.warning(f'An unexpected error was encountered saving tags to {path}:\n{e}')
+                saved = False
+            yield path, entry, saved
+    finally:
+        # Saves that haven't started are dropped if the caller stops early.
+        for future in futures:
+            future.cancel()
+
+
+def apply_renames(renames, journal=None, checkpoint=None):
+    """
+    Renames files in order, see rename_file.
+
+    :param journal: Optional RenameJournal with a begun batch, the renames that succeed are recorded in it.
+    :param checkpoint: Optional callable called before each rename. It may block to pause the renames,
+                       and returns False to stop. Renames are only stopped when no file is left with a temporary name.
+    :return: A generator of (old path, new path, renamed) as each rename is done.
+    """
+    # Temporary names in use, a cycle of renames is finished before stopping.
+    parked = set()
+    try:
+        for old_path, new_path in renames:
+            if checkpoint is not None and not checkpoint() and not parked:
+                log.info('Renaming stopped.')
+                return
+            renamed = rename_file(old_path, new_path)
+            if renamed and journal is not None:
+                journal.done(old_path, new_path)
+                # Which file has a temporary name can't be told from the files, so those renames are synced.
+                if is_temp_path(old_path) or is_temp_path(new_path):
+                    journal.sync()
+            parked.discard(old_path)
+            if renamed and is_temp_path(new_path):
+                parked.add(new_path)
+            yield old_path, new_path, renamed
+    finally:
+        if journal is not None:
+            journal.sync()
+
+
+def temp_path(path, taken):
+    """ A free temporary name next to a file, used to break rename cycles. """
+    count = 0
+    candidate = f'{path}{TEMP_SUFFIX}'
+    while os.path.normcase(candidate) in taken or os.path.lexists(candidate):
+        count += 1
+        candidate = f'{path}.{count}{TEMP_SUFFIX}'
+    taken.add(os.path.normcase(candidate))
+    return candidate
+
+
+def is_temp_path(path):
+    return path.endswith(TEMP_SUFFIX)
+
+
+def find_renames(files, folder_path):
+    """
+    Finds the files that need to be renamed, and orders the renames so all of them can be done in one pass.
+
+    A file can be renamed to the old name of another file that is renamed too. That file is then renamed first,
+    so chains (A -> B, B -> C) are done from the end. Swaps and other cycles (A -> B, B -> A) are broken by
+    moving one file to a temporary name first, and to its new name last.
+    If two files get the same new name, only the first is renamed.
+
+    :param files: The (old name, new name, extension) of each file.
+    :return: The (old path, new path) of each rename, in the order they have to be done.
+    """
+    # normcased old path -> (old path, new path)
+    moves = {}
+    targets = set()
+    key = os.path.normcase
+
+    for name, new_name, file_ext in files:
+        filename = ''.join((name, '.', file_ext.lower()))
+        new_filename = ''.join((new_name, '.', file_ext.lower()))
+
+        if new_filename == '.' or file_ext == '' or new_filename == filename:
+            continue
+
+        old_path = os.path.normpath(os.path.join(folder_path, filename))
+        new_path = os.path.normpath(os.path.join(folder_path, new_filename))
+
+        if key(new_path) in targets:
+            log.info(f'File "{filename}" can\'t be renamed to "{new_filename}", another file gets that name!')
+            continue
+        if key(old_path) in moves:
+            continue
+
+        targets.add(key(new_path))
+        moves[key(old_path)] = (old_path, new_path)
+
+    renames = []
+    done = set()
+    taken = set(moves) | targets
+
+    for start in moves:
+        if start in done:
+            continue
+
+        # Follows the files that have to move out of the way first, until a free name or a cycle.
+        path = []
+        current = start
+        while current in moves and current not in done:
+            old_path, new_path = moves[current]
+            path.append(current)
+            done.add(current)
+            current = key(new_path)
+            if current == key(old_path):
+                # Only the case changes, on a file system that ignores case.
+                break
+
+        if current == start and len(path) > 1:
+            # A cycle, the first file is moved out of the way, and to its new name after the others.
+            old_path, new_path = moves[start]
+            temp = temp_path(old_path, taken)
+            renames.append((old_path, temp))
+            renames.extend(moves[move] for move in reversed(path[1:]))
+            renames.append((temp, new_path))
+            log.info(f'Renaming {len(path)} files in a cycle, through "{temp}".')
+        else:
+            renames.extend(moves[move] for move in reversed(path))
+
+    return renames
+
+
+def rename_file(old_path, new_path):
+    """
+    Renames a file, returns if it succeeded. Errors are logged.
+    Never replaces another file, os.rename silently does that on everything but Windows.
+    """
+    try:
+        if os.path.lexists(new_path) and not os.path.samefile(old_path, new_path):
+            raise FileExistsError(f'"{new_path}" already exists.')
+        os.rename(old_path, new_path)
+        log.debug('File successfully renamed: %s renamed to %s.', old_path, new_path)
+        return True
+    except PermissionError as e:
+        log.warning(f'Error: Renaming failed. '
+                    f'Did not get permission to edit file. Might be in use already.')
+        log.debug(f'Full error: {e}')
+    except FileExistsError as e:
+        log.warning(f'Error: Renaming failed. File {new_path} already exists!')
+        log.debug(f'Full error: {e}')
+    except Exception as e:
+        log.warning(f'An unexpected error was encountered renaming'
+                    f' {old_path} to {new_path}, with error:\n{e}')
+
+    return False
+
+
+class PlanEntry(NamedTuple):
+    """
+    One row of the table, as it was when the rename plan was made.
+    The loaded tag is the (title, artist, file version) read when the folder was loaded, if known.
+    """
+    row_id: int
+    name: str
+    new_name: str
+    ext: str
+    title: str
+    artist: str
+    loaded: Optional[tuple] = None
+
+    def unchanged(self, path):
+        """
+        If the file still has the loaded tag, and the title and artist haven't been changed.
+        Only stats the file, the tag is not read again.
+        """
+        if self.loaded is None or self.loaded[:2] != (self.title, self.artist):
+            return False
+        try:
+            return file_version(os.stat(path)) == self.loaded[2]
+        except OSError:
+            return False
+
+
+class RenamePlan(NamedTuple):
+    """
+    What to tag and rename, taken from the table before the work starts.
+    It is immutable, so it can be handed to a worker thread that never touches the table.
+    """
+    folder_path: str
+    entries: Tuple[PlanEntry, ...]
+
+    def path(self, entry):
+        """ The path of the file of an entry, by its old name. """
+        return os.path.normpath(os.path.join(self.folder_path, ''.join((entry.name, '.', entry.ext.lower()))))
+
+    def load_tags(self):
+        """
+        Loads the tags of the files with a title or artist, and sets them on the tags.
+        Files that haven't changed since the folder was loaded, with the same title and artist, are skipped
+        without being read. Writes nothing.
+
+        :return: The (tag, path, entry) of each tag to save, and the (path, entry) of the files that failed to load.
+        """
+        saves = []
+        failed = []
+        for entry in self.entries:
+            if entry.title == '' and entry.artist == '':
+                continue
+
+            path = self.path(entry)
+            if entry.unchanged(path):
+                continue
+
+            try:
+                meta = tag_changes(path, entry.title, entry.artist)
+            except Exception as e:
+                log.warning(f'Error happened when setting tags for {path}:\n{e}')
+                failed.append((path, entry))
+                continue
+
+            if meta is not None:
+                saves.append((meta, path, entry))
+
+        return saves, failed
+
+    def renames(self):
+        """ The (old path, new path) of each file to rename. """
+        return find_renames([(entry.name, entry.new_name, entry.ext) for entry in self.entries], self.folder_path)
+
+    def preview(self):
+        """
+        A dry run of the plan, nothing is written.
+
+        :return: The (path, title, artist) of each tag that would be saved, the (old path, new path)
+                 of each rename, and the paths of the files that failed to load.
+        """
+        saves, failed = self.load_tags()
+        tags = [(path, entry.title, entry.artist) for meta, path, entry in saves]
+        return tags, self.renames(), [path for path, entry in failed]
+
+
+class RenameResult:
+    """
+    What a run of the Renamer did to the rows of its plan, so the table can be updated without loading the folder.
+    Renames are followed through temporary names back to the row of the file.
+    """
+    __slots__ = ('renamed', 'tagged', 'failed', 'reload', '_files')
+
+    def __init__(self, plan: RenamePlan):
+        # row id -> the new name of the file, without extension
+        self.renamed = {}
+        # row id -> the (title, artist, file version) of the file after its tag was saved
+        self.tagged = {}
+        # Row ids of the files that failed to be tagged or renamed.
+        self.failed = set()
+        # Set if a file was left with a temporary name, the table no longer matches the folder.
+        self.reload = False
+        # normcased current path -> entry
+        self._files = {os.path.normcase(plan.path(entry)): entry for entry in plan.entries}
+
+    def add_tag(self, entry: PlanEntry, saved, version=None):
+        if saved:
+            self.tagged[entry.row_id] = entry.title, entry.artist, version
+        else:
+            self.failed.add(entry.row_id)
+
+    def add_rename(self, old_path, new_path, renamed):
+        entry = self._files.get(os.path.normcase(old_path))
+        if entry is None:
+            return
+
+        if not renamed:
+            self.failed.add(entry.row_id)
+            self.reload = self.reload or is_temp_path(old_path)
+            return
+
+        del self._files[os.path.normcase(old_path)]
+        self._files[os.path.normcase(new_path)] = entry
+        if not is_temp_path(new_path):
+            self.renamed[entry.row_id] = entry.new_name
@@ -0,0 +1,114 @@
+import json
+import re
+from functools import lru_cache
+
+from filters import capitalize, clean_spaces, swap_positions
+from utils import get_logger
+
+log = get_logger('Tagger.rules')
+
+CASES = {'lower': str.lower,
+         'upper': str.upper,
+         'title': capitalize}
+
+
+class RuleError(ValueError):
+    """ A rule in the settings that can't be compiled. """
+
+
+def _text(rule, key, default=None):
+    """ A text option of a rule, hand edited settings can have anything in them. """
+    value = rule.get(key, default)
+    if not isinstance(value, str) and not (value is None and default is None):
+        raise RuleError(f'"{key}" has to be text, not {json.dumps(value)}.')
+    return value
+
+
+def _replace_step(rule):
+    pattern = _text(rule, 'pattern')
+    if pattern is None:
+        raise RuleError('A replace rule needs a pattern.')
+    try:
+        pattern = re.compile(pattern, 0 if rule.get('match_case', False) else re.IGNORECASE)
+    except re.error as e:
+        raise RuleError(f'Invalid pattern "{rule["pattern"]}": {e}')
+    replacement = _text(rule, 'with', '')
+    try:
+        pattern.sub(replacement, '')
+    except (re.error, IndexError) as e:
+        raise RuleError(f'Invalid replacement "{replacement}": {e}')
+    return lambda text: pattern.sub(replacement, text)
+
+
+def _strip_step(rule):
+    chars = _text(rule, 'chars')
+    return lambda text: text.strip(chars)
+
+
+def _case_step(rule):
+    case = CASES.get(_text(rule, 'case'))
+    if case is None:
+        raise RuleError(f'Unknown case "{rule.get("case")}", use one of: {", ".join(CASES)}.')
+    return case
+
+
+def _swap_step(rule):
+    return swap_positions
+
+
+STEPS = {'replace': _replace_step,
+         'strip': _strip_step,
+         'case': _case_step,
+         'swap': _swap_step}
+
+
+def compile_rules(rules):
+    """
+    Compiles a list of rules from the settings into one function from a new name to a new name.
+    The rules are done in order, and the spaces are cleaned up after them. Compiled rules are cached,
+    so compiling the same rules again is free.
+
+    A rule is a dict with an 'op' of:
+        replace: Replaces the regex 'pattern' with 'with', case insensitive unless 'match_case' is true.
+        strip: Strips 'chars' from both ends, or whitespace if not given.
+        case: Sets the 'case' to lower, upper or title.
+        swap: Swaps the artist and title of names like 'Artist - Title'.
+
+    :raises RuleError: If a rule is invalid.
+    :return: The function, or None if there are no rules.
+    """
+    if not rules:
+        return None
+    if not isinstance(rules, list):
+        raise RuleError('The rules have to be a list.')
+    return _compile(json.dumps(rules, sort_keys=True))
+
+
+@lru_cache(maxsize=16)
+def _compile(rules_json):
+    steps = []
+    for number, rule in enumerate(json.loads(rules_json), 1):
+        step = STEPS.get(rule.get('op')) if isinstance(rule, dict) else None
+        if step is None:
+            raise RuleError(f'Rule {number} has no valid op, use one of: {", ".join(STEPS)}.')
+        try:
+            steps.append(step(rule))
+        except RuleError as e:
+            raise RuleError(f'Rule {number}: {e}')
+
+    def transform(text):
+        for step in steps:
+            text = step(text)
+        return clean_spaces(text)
+
+    log.info(f'Compiled {len(steps)} rename rules.')
+    return transform
+
+
+def load_rules(settings):
+    """ Compiles the rules in the settings, invalid rules are logged and ignored. """
+    try:
+        return compile_rules(settings.get('rules'))
+    except RuleError as e:
+        log.warning(f'Rename rules are ignored: {e}')
+        return None
@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import *
+
+from filters import WordFilter
+from library import scan_folder, read_tags_cached, create_rows, NameReservations, DEFAULT_TAG_WORKERS
+from tag_cache import TagCache
+from utils import get_logger
+
+
+class Scanner(QThread):
+    """
+    Lists the music folder and parses the tags of every file, off the GUI thread.
+    Tags are read by a pool of worker threads, and rows are emitted in batches in the folder order,
+    so the table can be filled while the scan is still running.
+    """
+    BATCH_SIZE = 250
+
+    scanner_started = pyqtSignal(int)
+    scanner_update = pyqtSignal(list, int)
+    finished = pyqtSignal(int, bool)
+
+    def __init__(self, folder_path, word_filter: WordFilter = None, workers=DEFAULT_TAG_WORKERS, rules=None,
+                 parent=None):
+        """ :param rules: Optional rules from rules.compile_rules, applied to the new names. """
+        super(Scanner, self).__init__(parent)
+        self.log = get_logger('Tagger.scanner')
+        self.folder_path = folder_path
+        self.word_filter = WordFilter() if word_filter is None else word_filter
+        self.rules = rules
+        self.workers = max(1, workers)
+        self.cache = TagCache()
+        self.log.info('Scan thread initialized')
+
+    def run(self):
+        self.log.info(f'Scanning folder "{self.folder_path}"...')
+        rows = 0
+        done = 0
+
+        try:
+            entries, folder = scan_folder(self.folder_path)
+        except OSError as e:
+            self.log.warning(f'Failed to list folder "{self.folder_path}": {e}')
+            self.finished.emit(0, False)
+            return
+
+        self.scanner_started.emit(len(entries))
+        reserved = NameReservations(folder)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for start in range(0, len(entries), self.BATCH_SIZE):
+                if self.isInterruptionRequested():
+                    break
+
+                chunk = entries[start:start + self.BATCH_SIZE]
+                tags = read_tags_cached(chunk, pool, self.cache, self.isInterruptionRequested)
+                if self.isInterruptionRequested():
+                    # The tags of the chunk may be incomplete.
+                    break
+
+                # The reservations are shared by all chunks.
+                batch = create_rows(chunk, tags, reserved, self.word_filter, self.rules)
+                self.cache.commit()
+
+                rows += len(batch)
+                done += len(chunk)
+                self.scanner_update.emit(batch, done)
+
+        self.cache.close()
+
+        cancelled = self.isInterruptionRequested()
+        if cancelled:
+            self.log.info(f'Scan cancelled, {rows} files loaded.')
+        else:
+            self.log.info(f'Scan complete, {rows} files loaded.')
+        self.finished.emit(rows, cancelled)
@@ -2,64 +2,390 @@ import os
 import re
 import sys
 import traceback
-from functools import wraps
+from array import array
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
+from filters import split_tag, clean_spaces, remove_parentheses, remove_brackets, remove_numbers, \
+    remove_punctuation, swap_positions, compile_filter, WordFilter
+from renaming import PlanEntry, RenamePlan
+from undo import UndoJournal, DEFAULT_UNDO_ENTRIES, DEFAULT_UNDO_CELLS
 from utils import get_logger
 
 log = get_logger('Tagger.Table')
 
 
-def signal_blocker(func):
+def keep_original(model, row_id, text):
+    return model.text(row_id, model.OLD)
+
+
+def reverse_tag(model, row_id, text):
+    """ The name from the tag, as 'Artist - Title', if the file has both. """
+    title = model.text(row_id, model.TITLE).strip()
+    artist = model.text(row_id, model.ARTIST).strip()
+    if title == '' or artist == '':
+        return text
+    return artist + ' - ' + title
+
+
+# Actions that change the new name. Each takes the model, a row id and the name so far, and returns the new name,
+# so they can be chained, see TableWidget.apply_name_actions.
+NAME_ACTIONS = {'Keep original': keep_original,
+                'Remove parentheses': lambda model, row_id, text: remove_parentheses(text),
+                'Remove brackets': lambda model, row_id, text: remove_brackets(text),
+                'Remove numbers': lambda model, row_id, text: remove_numbers(text),
+                'Remove punctuation': lambda model, row_id, text: remove_punctuation(text),
+                'Reverse tag': reverse_tag,
+                'Swap positions': lambda model, row_id, text: swap_positions(text)}
+
+
+class TableModel(QAbstractTableModel):
     """
-    Wrapper that blocks signals while in the wrapped function.
-    Keeps the block if it was there before the function was called.
+    Holds the table as one list of strings per column, plus an int state per row.
+    Rows are referred to by a row id, which stays the same when the rows are sorted or removed.
+    The rows shown, and their order, is a list of row ids. Only the visible rows are ever asked for by the view.
+
+    The rows shown are also indexed by their (new name, extension), so name collisions can be found without
+    going through the table. Every change of a new name has to go through the model to keep the index right.
     """
+    OLD, NEW, EXT, TITLE, ARTIST = range(5)
+    HEADERS = ('Old name', 'New name', 'Filetype', 'Title', 'Artist')
+
+    # Row states, the handled state is used as sort key.
+    UNHANDLED = 0
+    FLAGGED = 1
+    RENAMED = 2
+
+    FLAGGED_COLOR = QColor('#e38c00')
+
+    name_edited = pyqtSignal(int, str)
+
+    def __init__(self, parent=None):
+        super(TableModel, self).__init__(parent)
+        self.columns = tuple([] for _ in self.HEADERS)
+        self.states = array('B')
+        # Row ids in the order they are shown, and the reverse lookup. Removed rows have a position of -1.
+        self.order = []
+        self.positions = array('l')
+        # (new name, extension) -> set of row ids
+        self.names = {}
+        # The (title, artist, file version) each file had when loaded, or None. Lets the Renamer skip unchanged tags.
+        self.loaded = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.order)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return section + 1
+
+    def flags(self, index):
+        flags = Qt.ItemIsSelectable | Qt.ItemIsEnabled
+        if index.column() == self.NEW:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row_id = self.order[index.row()]
+        column = index.column()
+
+        if role == Qt.DisplayRole or role == Qt.EditRole:
+            return self.columns[column][row_id]
+        elif role == Qt.BackgroundRole:
+            if column == self.NEW and self.states[row_id] & self.FLAGGED:
+                return self.FLAGGED_COLOR
+        elif role == Qt.TextAlignmentRole:
+            if column == self.EXT:
+                return Qt.AlignCenter
+
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        """ Called by the view when a name has been edited by the user. """
+        if role != Qt.EditRole or index.column() != self.NEW:
+            return False
+
+        row_id = self.order[index.row()]
+        old_text = self.columns[self.NEW][row_id]
+        self._unindex(row_id)
+        self.columns[self.NEW][row_id] = value
+        self._index(row_id)
+        self.dataChanged.emit(index, index)
+        self.name_edited.emit(row_id, old_text)
+        return True
+
+    def _key(self, row_id):
+        return self.columns[self.NEW][row_id], self.columns[self.EXT][row_id]
+
+    def _index(self, row_id):
+        self.names.setdefault(self._key(row_id), set()).add(row_id)
+
+    def _unindex(self, row_id):
+        key = self._key(row_id)
+        rows = self.names.get(key)
+        if rows is not None:
+            rows.discard(row_id)
+            if not rows:
+                del self.names[key]
+
+    def rows_named(self, name, ext):
+        """ Returns the ids of the rows shown with the given new name and extension. """
+        return self.names.get((name, ext), set())
+
+    def is_duplicate(self, row_id):
+        """ Checks if another row has the same new name and extension. """
+        return len(self.rows_named(*self._key(row_id)) - {row_id}) > 0
+
+    def _update_positions(self):
+        self.positions = array('l', [-1]) * len(self.states)
+        for position, row_id in enumerate(self.order):
+            self.positions[row_id] = position
+
+    def append_rows(self, rows):
+        """
+        Adds rows at the bottom of the table.
+        A row is a tuple of (old name, new name, extension, title, artist, flagged, file version).
+        The file version is None if it is not known, see renaming.file_version.
+        """
+        self.insert_rows(len(self.order), rows)
+
+    def insert_rows(self, first, rows):
+        """ Adds rows to the table, starting at the given position. See append_rows. """
+        if not rows:
+            return
 
-    @wraps(func)
-    def wrapper(self, *args, **kwargs):
-        if self.signalsBlocked():
-            keep_block = True
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+
+        old, new, ext, title, artist = self.columns
+        row_ids = []
+        for row in rows:
+            row_id = len(self.states)
+            old.append(row[0])
+            new.append(row[1])
+            ext.append(row[2])
+            title.append(row[3])
+            artist.append(row[4])
+            self.states.append(self.FLAGGED if row[5] else self.UNHANDLED)
+            self.loaded.append((row[3], row[4], row[6]) if row[6] is not None else None)
+            self.positions.append(-1)
+            row_ids.append(row_id)
+            self._index(row_id)
+
+        if first == len(self.order):
+            for position, row_id in enumerate(row_ids, first):
+                self.positions[row_id] = position
+            self.order.extend(row_ids)
         else:
-            keep_block = False
-            self.blockSignals(True)
+            self.order[first:first] = row_ids
+            self._update_positions()
+
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        for column in self.columns:
+            del column[:]
+        self.states = array('B')
+        self.order = []
+        self.positions = array('l')
+        self.names = {}
+        self.loaded = []
+        self.endResetModel()
+
+    def remove_rows(self, row_ids):
+        """ Removes rows from the table. Their data is kept until the table is cleared. """
+        positions = sorted({self.positions[row_id] for row_id in row_ids if self.positions[row_id] >= 0})
+
+        # Removes ranges of consecutive rows, starting from the bottom.
+        idx = len(positions) - 1
+        while idx >= 0:
+            last = first = positions[idx]
+            idx -= 1
+            while idx >= 0 and positions[idx] == first - 1:
+                first = positions[idx]
+                idx -= 1
+
+            self.beginRemoveRows(QModelIndex(), first, last)
+            for row_id in self.order[first:last + 1]:
+                self._unindex(row_id)
+            del self.order[first:last + 1]
+            self.endRemoveRows()
+
+        self._update_positions()
+
+    def row_ids(self):
+        """ Returns the ids of all rows, in the order they are shown. """
+        return list(self.order)
+
+    def rename_plan(self, folder_path):
+        """ Takes a snapshot of the rows shown, in order, for the Renamer. """
+        old, new, ext, title, artist = self.columns
+        loaded = self.loaded
+        return RenamePlan(folder_path, tuple(PlanEntry(row_id, old[row_id], new[row_id], ext[row_id], title[row_id],
+                                                       artist[row_id], loaded[row_id]) for row_id in self.order))
+
+    def row_id(self, row):
+        return self.order[row]
+
+    def position(self, row_id):
+        return self.positions[row_id]
+
+    def text(self, row_id, column):
+        return self.columns[column][row_id]
+
+    def set_text(self, row_id, column, text):
+        position = self.positions[row_id]
+        if column == self.NEW and position >= 0:
+            self._unindex(row_id)
+            self.columns[column][row_id] = text
+            self._index(row_id)
+        else:
+            self.columns[column][row_id] = text
+
+        if position >= 0:
+            index = self.index(position, column)
+            self.dataChanged.emit(index, index)
+
+    def set_texts(self, column, texts, flags=None):
+        """
+        Sets the text of many cells in a column, with one update of the view.
+
+        :param texts: row id -> text
+        :param flags: Optional row id -> flagged, set in the same update.
+        """
+        cells = self.columns[column]
+        positions = self.positions
+        indexed = column == self.NEW
+        shown = []
+        for row_id, text in texts.items():
+            if positions[row_id] >= 0:
+                shown.append(positions[row_id])
+                if indexed:
+                    self._unindex(row_id)
+                    cells[row_id] = text
+                    self._index(row_id)
+                    continue
+            cells[row_id] = text
+
+        if flags:
+            for row_id, flagged in flags.items():
+                if flagged != self.is_flagged(row_id):
+                    self.states[row_id] ^= self.FLAGGED
+                    if positions[row_id] >= 0:
+                        shown.append(positions[row_id])
+
+        if shown:
+            self.dataChanged.emit(self.index(min(shown), column), self.index(max(shown), column))
+
+    def _filename(self, row_id, column):
+        return ''.join((self.columns[column][row_id], '.', self.columns[self.EXT][row_id].lower()))
+
+    def files(self):
+        """ The files of the rows shown, as normcased filename -> (row id, file version when the tag was loaded). """
+        loaded = self.loaded
+        return {os.path.normcase(self._filename(row_id, self.OLD)):
+                (row_id, loaded[row_id][2] if loaded[row_id] is not None else None) for row_id in self.order}
+
+    def removed_files(self):
+        """ The normcased filenames of the rows removed from the table. """
+        return {os.path.normcase(self._filename(row_id, self.OLD))
+                for row_id in range(len(self.states)) if self.positions[row_id] < 0}
+
+    def new_filenames(self):
+        return [self._filename(row_id, self.NEW) for row_id in self.order]
+
+    def update_tags(self, updates):
+        """
+        Sets the tags of files that changed on disk. A title and artist that were edited in the table are kept.
+
+        :param updates: The (row id, title, artist, file version) of each file.
+        """
+        titles, artists = self.columns[self.TITLE], self.columns[self.ARTIST]
+        for row_id, title, artist, version in updates:
+            loaded = self.loaded[row_id]
+            if loaded is not None and (titles[row_id], artists[row_id]) == loaded[:2]:
+                self.set_text(row_id, self.TITLE, title)
+                self.set_text(row_id, self.ARTIST, artist)
+            self.loaded[row_id] = (title, artist, version)
+
+    def is_flagged(self, row_id):
+        return bool(self.states[row_id] & self.FLAGGED)
+
+    def set_flagged(self, row_id, flagged):
+        if flagged == self.is_flagged(row_id):
+            return
+
+        self.states[row_id] ^= self.FLAGGED
+        position = self.positions[row_id]
+        if position >= 0:
+            index = self.index(position, self.NEW)
+            self.dataChanged.emit(index, index, [Qt.BackgroundRole])
+
+    def handled_state(self, row_id):
+        return self.states[row_id] & ~self.FLAGGED
 
-        func(self, *args, **kwargs)
+    def set_handled_state(self, row_ids, state):
+        for row_id in row_ids:
+            self.states[row_id] = (self.states[row_id] & self.FLAGGED) | state
 
-        if not keep_block:
-            self.blockSignals(False)
+    def apply_rename_result(self, result):
+        """
+        Updates the rows after a run of the Renamer, instead of loading the folder again.
+        Renamed files get their new name as old name, and tagged files keep the tag they got as loaded tag.
+        """
+        old = self.columns[self.OLD]
+        for row_id, new_name in result.renamed.items():
+            old[row_id] = new_name
+        for row_id, loaded in result.tagged.items():
+            self.loaded[row_id] = loaded
 
-    return wrapper
+        positions = [self.positions[row_id] for row_id in result.renamed if self.positions[row_id] >= 0]
+        if positions:
+            self.dataChanged.emit(self.index(min(positions), self.OLD), self.index(max(positions), self.OLD))
 
+    def sort_by_state(self):
+        """ Stable sort of the rows by their handled state, keeping the selection on the same rows. """
+        self.layoutAboutToBeChanged.emit()
 
-class TableWidgetItem(QTableWidgetItem):
-    def __lt__(self, other):
-        return self.data(TableWidget.HANDLED_STATE) < other.data(TableWidget.HANDLED_STATE)
+        old_order = self.order
+        self.order = sorted(old_order, key=self.handled_state)
+        self._update_positions()
 
+        old_indexes = self.persistentIndexList()
+        new_indexes = [self.index(self.positions[old_order[index.row()]], index.column()) for index in old_indexes]
+        self.changePersistentIndexList(old_indexes, new_indexes)
 
-class TableWidget(QTableWidget):
-    RENAMED = '2'
-    UNHANDLED = '0'
+        self.layoutChanged.emit()
 
-    HANDLED_STATE = 32
-    HANDLED_TIME = 33
 
-    def __init__(self, folder, parent=None):
+class TableWidget(QTableView):
+    RENAMED = TableModel.RENAMED
+    UNHANDLED = TableModel.UNHANDLED
+
+    def __init__(self, folder, parent=None, undo_entries=DEFAULT_UNDO_ENTRIES, undo_cells=DEFAULT_UNDO_CELLS):
         super(TableWidget, self).__init__(parent=parent)
 
         self.folder_path = folder
+        self.setModel(TableModel(self))
         self.setCornerButtonEnabled(False)
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Fixed row heights, so the view never has to measure rows that are not shown.
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 8)
 
-        log.debug('Setting last edit state to None.')
-        self.last_pre_edit_state = None
-
-        self.undo_list = []
-        self._was_checkout = False
-        self.redo_list = []
+        self.undo_journal = UndoJournal(undo_entries, undo_cells)
+        # Row ids are reused when the table is cleared, so the history no longer applies.
+        self.model().modelReset.connect(self.undo_journal.clear)
 
         self.undo = QShortcut(QKeySequence('Ctrl+Z'), self)
         self.undo.activated.connect(self.undo_action)
@@ -71,173 +397,157 @@ class TableWidget(QTableWidget):
         self.shortcut.activated.connect(lambda: self.selectRow(2))
         # TODO: What if row 2 is non-existent?
 
-        self.actions = {'Keep original': self.revert,
-                        'Remove parentheses': self.remove_parentheses,
-                        'Remove brackets': self.remove_brackets,
-                        'Remove numbers': self.remove_numbers,
-                        'Remove punctuation': self.remove_punctuation,
+        # The rename rules from the settings, see rules.compile_rules.
+        self.rules = None
+
+        # Actions other than the name actions, see NAME_ACTIONS.
+        self.actions = {'Apply rules': self.apply_rules,
                         'Remove (Not delete)': self.delete_file,
-                        'Reverse tag': self.reverse_tag,
-                        'Swap positions': self.swap,
                         'Add tag(s)': self.create_tag,
                         'Play song': self.play_file,
                         'Checkout files': self.checkout_selection}
 
-        self.cellDoubleClicked.connect(self.on_dclick_enter)
-        self.cellChanged.connect(self._cell_change_handler)
-
-    # def sortItems(self, p_int, order=Qt.AscendingOrder):
-    #     print()
+        self.model().name_edited.connect(self._cell_change_handler)
+
+    def selected_rows(self):
+        """ Returns the row ids of the selected rows, top to bottom. """
+        model = self.model()
+        return [model.row_id(index.row()) for index in sorted(self.selectionModel().selectedRows(),
+                                                              key=lambda index: index.row())]
+
+    def _cell_change_handler(self, row_id, old_text):
+        model = self.model()
+        with self.undo_journal.group():
+            # The view has already set the new text.
+            self.undo_journal.record(row_id, model.NEW, old_text, model.text(row_id, model.NEW))
+            try:
+                self.name_control([row_id])
+            except Exception as e:
+                print(e)
+
+            if model.is_duplicate(row_id):
+                self.alert_message('Note!', 'One song already has that name!', '')
+                self.set_text(row_id, model.NEW, old_text)
+
+            text = model.text(row_id, model.NEW)
+            if old_text == text:
+                pass
 
-    def on_dclick_enter(self, row, col):
-        if col != 1:
-            return
-        log.debug(f'Cell entered with double click at row: {row}.')
-        self.last_pre_edit_state = self.item(row, col).text()
-        log.debug(f'Last edit state set to: "{self.last_pre_edit_state}".')
+            elif re.match(r'(^ *$)', text) is not None:
+                self.set_text(row_id, model.NEW, old_text)
+                self.alert_message('Warning!', 'Invalid name!', 'The name can not be just spaces or nothing!')
+            else:
+                log.debug(f'Adding "{old_text}" to undo log. Current name is "{text}"')
 
-    def _cell_change_handler(self, row, col):
+    def _cell_action(self, action: str, rows: list):
+        # Find action, perform on each row.
         try:
-            self.name_control([self.item(row, col)])
+            if action in NAME_ACTIONS:
+                self.apply_name_actions([action], rows)
+            else:
+                self.actions[action](rows)
         except Exception as e:
             print(e)
-        for iter_row in range(self.rowCount()):
-            if (self.item(row, 1).text() == self.item(iter_row, 1).text()) and (row != iter_row):
-                if self.item(row, 2).text() == self.item(iter_row, 2).text():
-                    # print(self.item(row, 2).text())
-                    # print(self.item(iter_row, 2).text())
-                    self.alert_message('Note!', 'One song already has that name!', '')
-                    self.item(row, 1).setText(self.last_pre_edit_state)
-
-        if self.last_pre_edit_state == self.item(row, col).text():
-            pass
-
-        elif re.match(r'(^ *$)', self.item(row, 1).text()) is not None:
-            self.item(row, col).setText(self.last_pre_edit_state)
-            self.alert_message('Warning!','Invalid name!','The name can not be just spaces or nothing!')
-        else:
-            # print('Cell changed:', self.item(row, col).text())
-            log.debug(f'Adding "{self.last_pre_edit_state}" to undo log.'
-                      f' Current name is "{self.item(row, col).text()}"')
-
-            self.undo_list.append(([self.item(row, col)], [self.last_pre_edit_state]))
+            traceback.print_exc()
 
-    def _cell_action(self, action: str, items: list):
-        # Find action, perform on each cell.
+    def apply_name_actions(self, actions, rows):
+        """
+        Runs name actions on rows in one pass, see NAME_ACTIONS. All new names are worked out first, and then set
+        with one update of the table. Several actions are done in order, as one undo entry.
+        Rows that would get a name that is already used keep their name.
+
+        :param actions: Names of NAME_ACTIONS, or functions like them.
+        """
+        model = self.model()
+        steps = [NAME_ACTIONS[action] if isinstance(action, str) else action for action in actions]
+        names = {}
+        flags = {}
+        for row_id in rows:
+            text = model.text(row_id, model.NEW)
+            for step in steps:
+                text = step(model, row_id, text)
+            text = clean_spaces(text)
+            names[row_id] = text
+            flags[row_id] = text.count(' - ') != 1
+
+        self.setUpdatesEnabled(False)
         try:
-            self.blockSignals(True)
+            with self.undo_journal.group():
+                old_names = self.set_texts(model.NEW, names, flags)
 
-            self.actions[action](items)
+                duplicates = [row_id for row_id in old_names if model.is_duplicate(row_id)]
+                if duplicates:
+                    self.set_texts(model.NEW, {row_id: old_names[row_id] for row_id in duplicates},
+                                   {row_id: old_names[row_id].count(' - ') != 1 for row_id in duplicates})
+        finally:
+            self.setUpdatesEnabled(True)
 
-            self.name_control([item for item in items if item.column() == 1])
-
-            # print(items)
-            # Restores from undo list, if a name already exists.
-            # TODO: Make this comprehensible!
-            for item in items:
-                if item.column() == 1:
-                    for iter_item in range(self.rowCount()):
-                        if self.item(iter_item, 1) != item and item.text() == self.item(iter_item, 1).text():
-                            if item.text() == self.item(iter_item, 2).text():
-
-                                self.alert_message('Note!', f'One song already is already named {item.text()}!', '')
-                                # a is the index of the item in the undo log.
-
-                                a = next(i for i, v in zip(range(len(self.undo_list[-1][0]) - 1, -1, -1),
-                                                           reversed(self.undo_list[-1][0])) if item == v)
-                                self.undo_list[-1][0][a].setText(self.undo_list[-1][1][a])
-                                # Removes the changed items from the undo log.
-                                del self.undo_list[-1][0][a], self.undo_list[-1][1][a]
-
-                        # print(a)
-            self.blockSignals(False)
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
+        if not duplicates:
+            return
+        names = [names[row_id] for row_id in duplicates]
+        if len(names) == 1:
+            self.alert_message('Note!', f'One song is already named {names[0]}!', '')
+        else:
+            self.alert_message('Note!', f'{len(names)} songs would get a name that is already used!',
+                               'Their names have been kept as they were:\n' + '\n'.join(names[:10]))
 
     def contextMenuEvent(self, event):
-        items = self.selectedItems()
-        # get the text inside selected cell (if any)
+        rows = self.selected_rows()
         menu = QMenu(self)
         # TODO: Rework menu to allow key shortcuts. Possibly, move to rename GUI.
-        try:
-
-            cursor = event.pos()
-            index = self.indexAt(cursor)
-
-            column = self.itemFromIndex(index).column()
+        column = self.indexAt(event.pos()).column()
+
+        if column == 1:
+            menu.addAction('Keep original')
+            menu.addAction('Remove brackets')
+            menu.addAction('Remove parentheses')
+            menu.addAction('Remove punctuation')
+            menu.addAction('Remove numbers')
+            menu.addAction('Reverse tag')
+            menu.addAction('Swap positions')
+            menu.addAction('Apply rules')
+            menu.addSeparator()
+        menu.addAction('Add tag(s)')
+        menu.addAction('Checkout files')
 
-            if column == 1:
-                menu.addAction('Keep original')
-                menu.addAction('Remove brackets')
-                menu.addAction('Remove parentheses')
-                menu.addAction('Remove punctuation')
-                menu.addAction('Remove numbers')
-                menu.addAction('Reverse tag')
-                menu.addAction('Swap positions')
-                menu.addSeparator()
-            menu.addAction('Add tag(s)')
-            menu.addAction('Checkout files')
+        if len(rows) == 1:
+            menu.addAction('Play song')
 
-            if len(items) == self.columnCount():
-                play = menu.addAction('Play song')
-
-            menu.addSeparator()
-            menu.addAction('Remove (Not delete)')
-        except:
-            traceback.print_exc()
+        menu.addSeparator()
+        menu.addAction('Remove (Not delete)')
 
         action = menu.exec_(QCursor.pos())
 
         try:
             if action and action.text() == 'Play song':
-                self.play_file([cell for cell in items if cell.column() in (0, 2)])
+                self.play_file(rows)
             elif action:
-                self._cell_action(action.text(), [cell for cell in items if cell.column() == 1])
+                self._cell_action(action.text(), rows)
         except Exception as e:
             log.warning(f'Failed call to action {action} with error: {e}')
             traceback.print_exc()
 
     def keyPressEvent(self, event):
         key = event.key()
-        # logging.debug(f'Keypress detected: {key}')
         if key == Qt.Key_Return and self.state() == QAbstractItemView.EditingState:
             modifier = QApplication.keyboardModifiers()
 
-            item = self.currentItem()
+            row = self.currentIndex().row()
 
             if Qt.ShiftModifier == modifier:
-                if item.row() == 0:
+                if row == 0:
                     return
-
-                self.blockSignals(True)
-                self.setCurrentCell(item.row() - 1, 1)
-                self.editItem(self.item(item.row() - 1, 1))
-                self.blockSignals(False)
-                # Hack to call function on the enter of the next cell!
-                self.cellChanged.emit(item.row(), 1)
-                # Must go before cellChanged, or else, the last edit will be saved for the wrong box!
-                self.cellDoubleClicked.emit(item.row() - 1, 1)
-
+                next_row = row - 1
             else:
-                if item.row() + 1 == self.rowCount():
+                if row + 1 == self.model().rowCount():
                     return
+                next_row = row + 1
+
+            # Changing the current cell commits the open editor, before the next one is opened.
+            index = self.model().index(next_row, 1)
+            self.setCurrentIndex(index)
+            self.edit(index)
 
-                self.blockSignals(True)
-                # Can close the editor.
-                # self.closePersistentEditor(item)
-                self.setCurrentCell(item.row() + 1, 1)
-                self.editItem(self.item(item.row() + 1, 1))
-                self.blockSignals(False)
-                # Hack to call function on the enter of the next cell!
-                self.cellChanged.emit(item.row(), 1)
-                # Must go before cellChanged, or else, the last edit will be saved for the wrong box!
-                self.cellDoubleClicked.emit(item.row() + 1, 1)
-
-            # self.editItem(self.item(item.row()+2, 1))
-        # elif key in (range(Qt.Key_A, Qt.Key_Z)):
-        #    # Detect key range
-        #    #logging.debug(f'Letter key pressed')
         else:
             modifier = QApplication.keyboardModifiers()
             if modifier == Qt.ControlModifier:
@@ -246,8 +556,6 @@ class TableWidget(QTableWidget):
 
             else:
                 pass
-            # logging.debug('Regular key detected, ignored input.')
-            # super().keyPressEvent(event)
 
     def alert_message(self, title, text, info_text, question=False, allow_cancel=False):
         warning_window = QMessageBox(parent=self)
@@ -265,245 +573,171 @@ class TableWidget(QTableWidget):
 
         return warning_window.exec()
 
-    @signal_blocker
-    def _move_sort(self, items, states, change_stack):
-        if items == TableWidget.RENAMED:
-            change_stack.append((TableWidget.UNHANDLED, states.copy()))
-        else:
-            change_stack.append((TableWidget.RENAMED, states.copy()))
+    def set_text(self, row_id, column, text):
+        """ Sets the text of a cell, and records the change in the undo journal. """
+        model = self.model()
+        old = model.text(row_id, column)
+        if old != text:
+            self.undo_journal.record(row_id, column, old, text)
+            model.set_text(row_id, column, text)
+
+    def _set_state(self, row_ids, state):
+        model = self.model()
+        model.set_handled_state(row_ids, state)
+        model.sort_by_state()
+
+    def set_texts(self, column, texts, flags=None):
+        """
+        Sets the text of many cells in a column with one update of the table, and records the changes
+        in the undo journal. See TableModel.set_texts.
+
+        :return: row id -> old text, of the cells that changed.
+        """
+        model = self.model()
+        changed = {}
+        old_texts = {}
+        for row_id, text in texts.items():
+            old = model.text(row_id, column)
+            if old != text:
+                self.undo_journal.record(row_id, column, old, text)
+                changed[row_id] = text
+                old_texts[row_id] = old
+        model.set_texts(column, changed, flags)
+        return old_texts
+
+    def _restore(self, entry, undo):
+        """ Sets the cells of an undo entry to their old text, or to their new text to redo it. """
+        if entry[0] == UndoJournal.STATE:
+            self._set_state(entry[3], entry[1] if undo else entry[2])
+            return
 
-        for cell in states:
-            cell.setData(TableWidget.HANDLED_STATE, items)
-        self.sortItems(1, Qt.AscendingOrder)
+        columns = {}
+        for row_id, column, old, new in entry:
+            columns.setdefault(column, {})[row_id] = old if undo else new
 
-    @signal_blocker
-    def undo_action(self):
-        if not self.undo_list:
-            return
+        model = self.model()
+        self.setUpdatesEnabled(False)
+        try:
+            for column, texts in columns.items():
+                model.set_texts(column, texts)
+        finally:
+            self.setUpdatesEnabled(True)
 
-        items, states = self.undo_list.pop()
-        if isinstance(items, str):
-            self._move_sort(items, states, self.redo_list)
-        else:
-            self.redo_list.append((items, [cell.text() for cell in items]))
-            for cell, text in zip(items, states):
-                cell.setText(text)
+    def undo_action(self):
+        entry = self.undo_journal.undo()
+        if entry is not None:
+            self._restore(entry, True)
 
-    @signal_blocker
     def redo_action(self):
-        if not self.redo_list:
-            return
-        items, states = self.redo_list.pop()
-        if isinstance(items, str):
-            self._move_sort(items, states, self.undo_list)
-        else:
-            self.undo_list.append((items, [cell.text() for cell in items]))
-            for cell, text in zip(items, states):
-                cell.setText(text)
+        entry = self.undo_journal.redo()
+        if entry is not None:
+            self._restore(entry, False)
 
-    @signal_blocker
-    def name_control(self, items):
+    def name_control(self, rows):
         # Potential for other post-prosessing options, like checking if it's different from the original str.
-        # Does not call on cell edits, only on right-click actions.
-        for cell in items:
-            text = cell.text()
-            text = re.sub(r'(^ +)', '', text)
-            text = re.sub(r'( +)', ' ', text)
-            text = re.sub(r'( +$)', '', text)
-
-            if text.count(' - ') != 1:
-                cell.setBackground(QColor('#e38c00'))
-            else:
-                cell.setBackground(QColor('#484848'))
-            cell.setText(text)
-            # if ' - ' in cell.text():
-            #     cell.setBackground(QColor('#303030'))
-
-    @signal_blocker
-    def swap(self, items):
-        self.undo_list.append((items, [cell.text() for cell in items]))
-        cell_changed = False
-
-        for cell in items:
-            if cell.text().count(' - ') != 1:
-                pass
-            else:
-                cell.setText(' - '.join(reversed(cell.text().split(' - '))))
-                cell_changed = True
-
-        if not cell_changed:
-            self.undo_list.pop()
-
-    @signal_blocker
-    def revert(self, items):
-        self.undo_list.append((items, [cell.text() for cell in items]))
-        cell_changed = False
-
-        for cell in items:
-            original = self.item(cell.row(), 0)
-            if original != cell.text():
-                cell.setText(original.text())
-                cell_changed = True
-
-        if not cell_changed:
-            self.undo_list.pop()
-
-    @signal_blocker
-    def remove_numbers(self, items):
-        self.undo_list.append((items, [cell.text() for cell in items]))
-        cell_changed = False
-
-        for cell in items:
-            text, changed = re.subn(r'[0-9]*', '', cell.text())
-            if changed:
-                cell.setText(text)
-                cell_changed = True
-
-        if not cell_changed:
-            self.undo_list.pop()
-
-    @signal_blocker
-    def reverse_tag(self, items):
-        self.undo_list.append((items, [cell.text() for cell in items]))
-        cell_changed = False
-
-        for cell in items:
-            row = cell.row()
-            title = self.item(row, 3).text().strip()
-            artist = self.item(row, 4).text().strip()
-
-            if title == '' or artist == '':
-                continue
-
-            new_name = artist + ' - ' + title
-            if cell.text() != new_name:
-                cell.setText(new_name)
-                cell_changed = True
-
-        if not cell_changed:
-            self.undo_list.pop()
-
-    @signal_blocker
-    def remove_parentheses(self, items):
-        self.undo_list.append((items, [cell.text() for cell in items]))
-        cell_changed = False
-        for cell in items:
-            text, changed = re.subn(r' *\([^)]*\) *', '', cell.text())
-            text, changed_ = re.subn(r'[\(\)]', '', text)
-            if changed or changed_:
-                cell.setText(text)
-                cell_changed = True
-
-        if not cell_changed:
-            self.undo_list.pop()
-
-    @signal_blocker
-    def remove_brackets(self, items):
-        self.undo_list.append((items, [cell.text() for cell in items]))
-        cell_changed = False
-
-        for cell in items:
-            text, changed = re.subn(r' *\[[^)]*\] *', '', cell.text())
-            text, changed_ = re.subn(r'[\[\]]', '', text)
-            if changed or changed_:
-                cell.setText(text)
-                cell_changed = True
-
-        if not cell_changed:
-            self.undo_list.pop()
-
-    @signal_blocker
-    def checkout_selection(self, items):
-        self.undo_list.append((TableWidget.UNHANDLED, items))
-
-        cell_changed = False
-
-        for cell in items:
-            cell.setData(TableWidget.HANDLED_STATE, TableWidget.RENAMED)
-            cell_changed = True
-
-        self.sortItems(1, Qt.AscendingOrder)
-        if not cell_changed:
-            self.undo_list.pop()
-
-    @signal_blocker
-    def remove_punctuation(self, items):
-        self.undo_list.append((items, [cell.text() for cell in items]))
-        cell_changed = False
-
-        for cell in items:
-            text, changed = re.subn(r'[.,\'\"]*', '', cell.text())
-            if changed:
-                cell.setText(text)
-                cell_changed = True
-
-        if not cell_changed:
-            self.undo_list.pop()
+        # Only called on cell edits, the name actions clean up the names themselves.
+        model = self.model()
+        names = {row_id: clean_spaces(model.text(row_id, model.NEW)) for row_id in rows}
+        self.set_texts(model.NEW, names, {row_id: text.count(' - ') != 1 for row_id, text in names.items()})
+
+    def apply_rules(self, rows):
+        if self.rules is None:
+            self.alert_message('No rules!', 'There are no rename rules to apply.',
+                               'Rules are added to "rules" in settings.json, see the README.')
+            return
+        rules = self.rules
+        self.apply_name_actions([lambda model, row_id, text: rules(text)], rows)
+
+    def refilter(self, old_filter: WordFilter, new_filter: WordFilter):
+        """
+        Gives new names from a changed word filter, only to the rows with a word that was added, removed or
+        replaced differently. Rows whose name was changed since it was suggested are left alone.
+
+        :return: The number of rows that got a new name.
+        """
+        old_words, new_words = old_filter.get_replace_dict(), new_filter.get_replace_dict()
+        changed = {word for word in old_words.keys() | new_words.keys() if old_words.get(word) != new_words.get(word)}
+        if not changed:
+            return 0
+
+        model = self.model()
+        pattern = compile_filter(changed)
+        rows = [row_id for row_id in model.row_ids() if pattern.search(model.text(row_id, model.OLD))]
+
+        rules = self.rules if self.rules is not None else clean_spaces
+
+        def suggest(model, row_id, text):
+            # Names are compared with the spaces cleaned up, as the name actions leave them.
+            old_name = model.text(row_id, model.OLD)
+            if clean_spaces(text) != rules(old_filter.normalize(old_name)):
+                return text
+            return rules(new_filter.normalize(old_name))
+
+        names = {row_id: model.text(row_id, model.NEW) for row_id in rows}
+        self.apply_name_actions([suggest], rows)
+        renamed = sum(model.text(row_id, model.NEW) != name for row_id, name in names.items())
+        log.info(f'Word filter changed, {len(rows)} rows use the changed words, {renamed} got a new name.')
+        return renamed
+
+    def checkout_selection(self, rows):
+        self.undo_journal.record_state(rows, TableWidget.UNHANDLED, TableWidget.RENAMED)
+        self._set_state(rows, TableWidget.RENAMED)
+
     # TODO: Add tag -> Song name function
     # TODO: Add option to view log on rename errors.
     # TODO: Possibly let user swap columns for title/artist
     # TODO:
 
-    @signal_blocker
-    def delete_file(self, items):
-        for cell in items:
-            # os.remove()
-            row = cell.row()
-            self.removeRow(cell.row())
-        del items[:]
-        # print('Selecting row')
-        self.selectRow(row)
-        # print('Done selecting row')
-
-    def play_file(self, items):
-        # Recieves a list of items.
-        path = os.path.join(self.folder_path, f'{items[0].text()}.{items[1].text().lower()}')
+    def delete_file(self, rows):
+        if not rows:
+            return
+        model = self.model()
+        row = model.position(rows[-1])
+        model.remove_rows(rows)
+        del rows[:]
+        self.selectRow(min(row, model.rowCount() - 1))
+
+    def play_file(self, rows):
+        # Recieves a list of row ids, plays the first.
+        model = self.model()
+        name, ext = model.text(rows[0], model.OLD), model.text(rows[0], model.EXT)
+        path = os.path.join(self.folder_path, f'{name}.{ext.lower()}')
         log.info(f'Starting song at: {path}')
         if QDesktopServices.openUrl(QUrl.fromLocalFile(path)):
             log.info('Song start was successful!')
         else:
             log.warning('Failed to start song!')
 
-    @signal_blocker
-    def create_tag(self, items):
-        self.undo_list.append((items, [cell.text() for cell in items]))
-        cell_changed = False
-
-        for item in items:
-            if item.column() == 1:
-                row = item.row()
-                if item.text().count(' - ') == 1:
-                    artist, title = item.text().split(' - ')
-                    if title != self.item(row, 3).text() or \
-                            artist != self.item(row, 4).text():
-                        cell_changed = True
-                        self.item(row, 3).setText(title)
-                        self.item(row, 4).setText(artist)
+    def create_tag(self, rows):
+        model = self.model()
+        titles = {}
+        artists = {}
+        for row_id in rows:
+            tag = split_tag(model.text(row_id, model.NEW))
+            if tag is not None:
+                artists[row_id], titles[row_id] = tag
+
+        self.setUpdatesEnabled(False)
+        try:
+            with self.undo_journal.group():
+                self.set_texts(model.TITLE, titles)
+                self.set_texts(model.ARTIST, artists)
+        finally:
+            self.setUpdatesEnabled(True)
 
         self.resizeColumnsToContents()
-        self.resizeRowsToContents()
 
         horizontal_header = self.horizontalHeader()
         horizontal_header.setSectionResizeMode(0, QHeaderView.Stretch)
         horizontal_header.setSectionResizeMode(1, QHeaderView.Stretch)
 
-        if not cell_changed:
-            self.undo_list.pop()
-
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
 
     gui = TableWidget('test')
-    gui.blockSignals(True)
-    gui.setColumnCount(3)
-    gui.insertRow(0)
-    gui.insertRow(0)
-    gui.insertRow(0)
-    gui.setItem(0, 0, QTableWidgetItem('0'))
-    gui.setItem(1, 0, QTableWidgetItem('0'))
-    gui.setItem(2, 0, QTableWidgetItem('0'))
-    gui.setItem(0, 1, QTableWidgetItem('0'))
-    gui.blockSignals(False)
+    gui.model().append_rows([('0', '0', 'MP3', '', '', False, None),
+                             ('0', '1', 'MP3', '', '', False, None),
+                             ('0', '2', 'MP3', '', '', True, None)])
     gui.show()
     app.exec()
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+
+from utils import get_logger, TAG_CACHE_FILE
+
+log = get_logger('Tagger.cache')
+
+
+class TagCache:
+    """
+    A small SQLite database with the title and artist of each file, so files don't need their tags parsed again.
+    Entries are keyed by path, and are only used while the size and modification time of the file still match.
+
+    The connection is opened by the thread that first uses the cache, so each thread needs its own TagCache.
+    If the database can't be used, the cache disables itself and every lookup is a miss.
+    """
+
+    def __init__(self, path=TAG_CACHE_FILE):
+        self.path = path
+        self._connection = None
+        self._disabled = False
+
+    @staticmethod
+    def key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def _connect(self):
+        if self._connection is None and not self._disabled:
+            try:
+                self._connection = sqlite3.connect(self.path, timeout=10)
+                self._connection.execute('CREATE TABLE IF NOT EXISTS tags ('
+                                         'path TEXT PRIMARY KEY, '
+                                         'size INTEGER NOT NULL, '
+                                         'mtime INTEGER NOT NULL, '
+                                         'title TEXT NOT NULL, '
+                                         'artist TEXT NOT NULL)')
+            except sqlite3.Error as e:
+                self._error(e)
+
+        return self._connection
+
+    def _error(self, error):
+        log.warning(f'Tag cache disabled, failed to use "{self.path}": {error}')
+        self._disabled = True
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get(self, path, stat):
+        """ Returns the cached (title, artist) of a file, or None if missing or the file has changed. """
+        connection = self._connect()
+        if connection is None:
+            return None
+
+        try:
+            entry = connection.execute('SELECT size, mtime, title, artist FROM tags WHERE path = ?',
+                                       (self.key(path),)).fetchone()
+        except sqlite3.Error as e:
+            self._error(e)
+            return None
+
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            return None
+
+        return entry[2], entry[3]
+
+    def put(self, path, stat, title, artist):
+        connection = self._connect()
+        if connection is None:
+            return
+
+        try:
+            connection.execute('INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?)',
+                               (self.key(path), stat.st_size, stat.st_mtime_ns, title, artist))
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def rename(self, old_path, new_path):
+        """ Moves the entry of a renamed file, renaming does not change the size or modification time. """
+        connection = self._connect()
+        if connection is None or self.key(old_path) == self.key(new_path):
+            return
+
+        try:
+            connection.execute('INSERT OR REPLACE INTO tags '
+                               'SELECT ?, size, mtime, title, artist FROM tags WHERE path = ?',
+                               (self.key(new_path), self.key(old_path)))
+            connection.execute('DELETE FROM tags WHERE path = ?', (self.key(old_path),))
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def commit(self):
+        if self._connection is not None:
+            try:
+                self._connection.commit()
+            except sqlite3.Error as e:
+                self._error(e)
+
+    def close(self):
+        if self._connection is not None:
+            self.commit()
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,117 @@
+import sys
+from collections import deque
+from contextlib import contextmanager
+
+from utils import get_logger
+
+log = get_logger('Tagger.undo')
+
+DEFAULT_UNDO_ENTRIES = 100
+# About 100 bytes per change, so about 100 MB of undo history at most.
+DEFAULT_UNDO_CELLS = 1_000_000
+
+
+class UndoJournal:
+    """
+    The undo and redo history of the table, as the changes that were made instead of copies of the table.
+
+    An entry is either a tuple of changed cells as (row id, column, old text, new text), or a state change as
+    (STATE, old state, new state, row ids). Only cells that actually changed are kept, so undoing an entry of
+    k cells is O(k) no matter how many rows were selected.
+
+    The oldest entries are dropped when there are more than max_entries entries, or more than max_cells cells
+    in all of them. The newest entry is always kept.
+    """
+    STATE = -1
+
+    def __init__(self, max_entries=DEFAULT_UNDO_ENTRIES, max_cells=DEFAULT_UNDO_CELLS):
+        self.max_entries = max(1, max_entries)
+        self.max_cells = max(1, max_cells)
+        self.undo_list = deque()
+        self.redo_list = deque()
+        self._cells = 0
+        # (row id, column) -> [old text, new text] of the open group, see group.
+        self._group = None
+        self._depth = 0
+
+    def __len__(self):
+        return len(self.undo_list)
+
+    @staticmethod
+    def _size(entry):
+        return len(entry[3]) if entry[0] == UndoJournal.STATE else len(entry)
+
+    @contextmanager
+    def group(self):
+        """
+        Collects the changes recorded inside the block into one entry. Groups can be nested, the outermost one
+        makes the entry. A cell changed several times is kept once, and left out if it ends up unchanged.
+        """
+        if self._depth == 0:
+            self._group = {}
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                group, self._group = self._group, None
+                changes = tuple((row_id, column, old, new) for (row_id, column), (old, new) in group.items()
+                                if old != new)
+                if changes:
+                    self._push(changes)
+
+    def record(self, row_id, column, old, new):
+        """ Records a change of a cell, as its own entry unless a group is open. """
+        if old == new:
+            return
+        if self._group is None:
+            self._push(((row_id, column, sys.intern(old), sys.intern(new)),))
+            return
+
+        change = self._group.get((row_id, column))
+        if change is None:
+            self._group[(row_id, column)] = [sys.intern(old), sys.intern(new)]
+        else:
+            change[1] = sys.intern(new)
+
+    def record_state(self, row_ids, old_state, new_state):
+        """ Records that the handled state of rows was changed. """
+        if row_ids:
+            self._push((self.STATE, old_state, new_state, tuple(row_ids)))
+
+    def _push(self, entry):
+        self.redo_list.clear()
+        self._append(self.undo_list, entry)
+
+    def _append(self, entries, entry):
+        entries.append(entry)
+        if entries is self.undo_list:
+            self._cells += self._size(entry)
+            while len(entries) > 1 and (len(entries) > self.max_entries or self._cells > self.max_cells):
+                self._cells -= self._size(entries.popleft())
+                log.debug('Dropped the oldest undo entry.')
+        elif len(entries) > self.max_entries:
+            entries.popleft()
+
+    def undo(self):
+        """ Moves the newest entry to the redo list, and returns it to be undone, or None if there is none. """
+        if not self.undo_list:
+            return None
+        entry = self.undo_list.pop()
+        self._cells -= self._size(entry)
+        self._append(self.redo_list, entry)
+        return entry
+
+    def redo(self):
+        """ Moves the newest undone entry back to the undo list, and returns it to be redone, or None. """
+        if not self.redo_list:
+            return None
+        entry = self.redo_list.pop()
+        self._append(self.undo_list, entry)
+        return entry
+
+    def clear(self):
+        self.undo_list.clear()
+        self.redo_list.clear()
+        self._cells = 0
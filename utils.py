@@ -1,29 +1,66 @@
+import atexit
 import json
 import logging
 import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 LOG_FILE = 'rename.log'
+# The log is rotated when it gets this big, keeping LOG_BACKUPS old logs as rename.log.1 and so on.
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+DEFAULT_LOG_LEVEL = 'DEBUG'
+TAG_CACHE_FILE = 'tag_cache.db'
+RENAME_JOURNAL_FILE = 'rename_journal.jsonl'
+
+
+class _LogQueueHandler(QueueHandler):
+    """ Puts records on the log queue as they are, so the message is formatted by the listener thread. """
+
+    def prepare(self, record):
+        return record
+
 
 log = logging.getLogger('Tagger')
-log.setLevel(logging.DEBUG)
+log.setLevel(DEFAULT_LOG_LEVEL)
 
 formatter = logging.Formatter('{name:<15}:{levelname:<7}: {message}', style="{")
 
-filehandler = logging.FileHandler(LOG_FILE, encoding='utf-8')
+filehandler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8',
+                                  delay=True)
 filehandler.setFormatter(formatter)
-filehandler.setLevel(logging.DEBUG)
-log.addHandler(filehandler)
 
 ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
 ch.setFormatter(formatter)
-log.addHandler(ch)
+
+# Records are written by a background thread, so logging never waits for the disk or the console.
+log_queue = queue.SimpleQueue()
+log.addHandler(_LogQueueHandler(log_queue))
+log_listener = QueueListener(log_queue, filehandler, ch)
+log_listener.start()
+# Writes what is left in the queue before the program exits.
+atexit.register(log_listener.stop)
 
 
 def get_logger(string):
     return logging.getLogger(string)
 
 
+def set_log_level(level):
+    """
+    Sets the level of the Tagger loggers, by name like 'INFO' or as a number. Messages below it are dropped
+    before they are formatted.
+    """
+    if isinstance(level, str):
+        level = level.upper()
+    try:
+        log.setLevel(level)
+    except (ValueError, TypeError):
+        log.warning(f'Unknown log level "{level}", using {DEFAULT_LOG_LEVEL}.')
+        log.setLevel(DEFAULT_LOG_LEVEL)
+
+
 # TODO: Add loading when loading files
 
 class FileHandler:
@@ -114,6 +151,46 @@ def color_text(text: str, color: str = 'darkorange', weight: str = 'bold', secti
     return string
 
 
+class ProgressMeter:
+    """
+    Counts the progress of a phase of work, and tells when it is worth reporting.
+    Reports are at most every interval seconds, and every min_count items, so a fast loop doesn't flood the GUI
+    with signals. The last item is always reported.
+    """
+
+    def __init__(self, total, interval=0.1, min_count=None):
+        self.total = total
+        self.done = 0
+        self.interval = interval
+        self.min_count = max(1, total // 1000) if min_count is None else min_count
+        self.start = time.perf_counter()
+        self._reported_at = self.start
+        self._reported = 0
+
+    def step(self, count=1):
+        """ Counts finished items, returns if the progress should be reported now. """
+        self.done += count
+        now = time.perf_counter()
+        if self.done >= self.total or (now - self._reported_at >= self.interval
+                                       and self.done - self._reported >= self.min_count):
+            self._reported_at = now
+            self._reported = self.done
+            return True
+        return False
+
+    @property
+    def rate(self):
+        """ Items per second so far. """
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """ Estimated seconds left, or -1 if not known yet. """
+        rate = self.rate
+        return (self.total - self.done) / rate if rate > 0 else -1.0
+
+
 
 stylesheet = """
                 QWidget {
@@ -0,0 +1,115 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import *
+
+from filters import WordFilter
+from library import scan_folder, split_extension, read_tags_cached, create_rows, NameReservations, \
+    DEFAULT_TAG_WORKERS
+from renaming import file_version
+from tag_cache import TagCache
+from utils import get_logger
+
+
+class FolderWatcher(QObject):
+    """
+    Watches the music folder, and emits changed once it has stopped changing for a moment,
+    so a download of many files only causes one update of the table.
+    """
+    DEBOUNCE_MS = 750
+
+    changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(FolderWatcher, self).__init__(parent)
+        self.log = get_logger('Tagger.watcher')
+        self.watcher = QFileSystemWatcher(self)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DEBOUNCE_MS)
+
+        self.watcher.directoryChanged.connect(self.timer.start)
+        self.timer.timeout.connect(self.changed)
+
+    def watch(self, folder_path):
+        self.stop()
+        if not self.watcher.addPath(folder_path):
+            self.log.warning(f'Failed to watch folder "{folder_path}".')
+        else:
+            self.log.info(f'Watching folder "{folder_path}".')
+
+    def stop(self):
+        self.timer.stop()
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+
+    def postpone(self):
+        """ Checks again after the debounce time, for when the table can't be updated right now. """
+        self.timer.start()
+
+
+class FolderSync(QThread):
+    """
+    Finds what changed in the music folder since the table was loaded, off the GUI thread.
+    Emits synced with the rows of new files, the row ids of files that are gone, and the new tags of files
+    that changed, as (row id, title, artist, file version).
+    """
+    synced = pyqtSignal(list, list, list)
+
+    def __init__(self, folder_path, files, removed, taken, word_filter: WordFilter = None,
+                 workers=DEFAULT_TAG_WORKERS, rules=None, parent=None):
+        """
+        :param files: The files in the table, see TableModel.files.
+        :param removed: The files removed from the table, these are not added again.
+        :param taken: The new names of the files in the table, with extension, so new files don't get them.
+        :param rules: Optional rules from rules.compile_rules, applied to the new names.
+        """
+        super(FolderSync, self).__init__(parent)
+        self.log = get_logger('Tagger.watcher')
+        self.folder_path = folder_path
+        self.files = files
+        self.removed = removed
+        self.taken = taken
+        self.word_filter = WordFilter() if word_filter is None else word_filter
+        self.workers = max(1, workers)
+        self.rules = rules
+
+    def run(self):
+        try:
+            entries, folder = scan_folder(self.folder_path)
+        except OSError as e:
+            self.log.warning(f'Failed to list folder "{self.folder_path}": {e}')
+            return
+
+        seen = set()
+        added = []
+        changed = []
+        for entry in entries:
+            # The table only knows the extension in upper case.
+            name, ext = split_extension(entry.name)
+            key = os.path.normcase(''.join((name, '.', ext.lower())))
+            known = self.files.get(key)
+            if known is None:
+                if key not in self.removed:
+                    added.append(entry)
+                continue
+
+            seen.add(key)
+            row_id, version = known
+            if version != file_version(entry.stat()):
+                changed.append((row_id, entry))
+
+        missing = [row_id for key, (row_id, version) in self.files.items() if key not in seen]
+
+        cache = TagCache()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            tags = read_tags_cached(added + [entry for row_id, entry in changed], pool, cache)
+        cache.close()
+
+        rows = create_rows(added, tags, NameReservations(folder + self.taken), self.word_filter, self.rules)
+
+        updates = [(row_id, title, artist, file_version(entry.stat()))
+                   for (row_id, entry), (title, artist) in zip(changed, tags[len(added):])]
+
+        self.log.info(f'Folder changed, {len(rows)} new, {len(missing)} removed and {len(updates)} changed files.')
+        self.synced.emit(rows, missing, updates)